@@ -1,86 +1,1001 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, abort, g, has_request_context
 from flask_cors import CORS
-from supabase import create_client
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from functools import wraps
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+from werkzeug.security import safe_join
+from werkzeug.middleware.proxy_fix import ProxyFix
+from collections import OrderedDict
+from urllib.parse import quote, urlencode
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import os
+import atexit
 import secrets
+import base64
+import bisect
+import contextvars
+import hmac
+import html
+import re
 import uuid
 import json
-import stripe
+import math
+import gzip
+import hashlib
+import mimetypes
+import queue
+import tempfile
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 load_dotenv()
 
+# Heavy SDKs (supabase/httpx, stripe, google.auth, requests, redis) are imported
+# where they are first used rather than here, so cold starts that only serve
+# pages or cached catalog data skip them. `python startup_benchmark.py` checks
+# this stays true.
+
 app = Flask(__name__)
 CORS(app)
 
-supabase = create_client(
-    os.getenv('SUPABASE_URL'),
-    os.getenv('SUPABASE_KEY')
-)
+# Number of proxies in front of the app whose X-Forwarded-For entries are
+# trusted for the client address. 0 uses the socket address; vercel.json sets
+# 1 for Vercel's edge
+PROXY_HOPS = int(os.getenv('PROXY_HOPS', '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# --- Data Access ---
+
+# PostgREST connection pool; every Supabase call is bounded by these timeouts
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv('SUPABASE_CONNECT_TIMEOUT', '3'))
+SUPABASE_READ_TIMEOUT = float(os.getenv('SUPABASE_READ_TIMEOUT', '10'))
+SUPABASE_POOL_TIMEOUT = float(os.getenv('SUPABASE_POOL_TIMEOUT', '5'))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv('SUPABASE_MAX_CONNECTIONS', '20'))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv('SUPABASE_MAX_KEEPALIVE', '10'))
+SUPABASE_KEEPALIVE_SECONDS = float(os.getenv('SUPABASE_KEEPALIVE_SECONDS', '30'))
+SUPABASE_HTTP2 = os.getenv('SUPABASE_HTTP2', '1') == '1'
+
+class QueryMetrics:
+    """Per-table PostgREST call counts, errors and latency histograms"""
+
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, table, method, status, elapsed_ms):
+        bucket = next((i for i, bound in enumerate(self.BUCKETS_MS) if elapsed_ms <= bound), len(self.BUCKETS_MS))
+        with self._lock:
+            series = self._series.get((table, method))
+            if series is None:
+                series = self._series[(table, method)] = {
+                    'count': 0,
+                    'errors': 0,
+                    'total_ms': 0.0,
+                    'buckets': [0] * (len(self.BUCKETS_MS) + 1)
+                }
+            series['count'] += 1
+            series['total_ms'] += elapsed_ms
+            series['buckets'][bucket] += 1
+            if status == 'error' or status >= 400:
+                series['errors'] += 1
+
+    def snapshot(self):
+        """Return {(table, method): series} with copied counters"""
+        with self._lock:
+            return {key: dict(series, buckets=list(series['buckets'])) for key, series in self._series.items()}
+
+    def summary(self):
+        return {
+            f'{method} {table}': {
+                'count': series['count'],
+                'errors': series['errors'],
+                'avg_ms': round(series['total_ms'] / series['count'], 1)
+            }
+            for (table, method), series in sorted(self.snapshot().items())
+        }
+
+db_metrics = QueryMetrics()
+
+def table_from_path(path):
+    """'/rest/v1/users' -> 'users', '/rest/v1/rpc/grant_metaphors' -> 'rpc:grant_metaphors'"""
+    parts = path.rstrip('/').split('/')
+    if len(parts) >= 2 and parts[-2] == 'rpc':
+        return f'rpc:{parts[-1]}'
+    return parts[-1]
+
+def create_supabase_client():
+    """Create the Supabase client with a bounded, instrumented PostgREST connection pool"""
+    import httpx
+    from postgrest.utils import SyncClient as PostgrestSession
+    from supabase import create_client
+
+    class PooledPostgrestSession(PostgrestSession):
+        """Keep-alive PostgREST HTTP session that records per-table call latency"""
+
+        def send(self, request, **kwargs):
+            start = time.perf_counter()
+            status = 'error'
+            try:
+                response = super().send(request, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                table = table_from_path(request.url.path)
+                db_metrics.record(table, request.method, status, elapsed_ms)
+                note_db_time(table, elapsed_ms)
+
+    client = create_client(
+        os.getenv('SUPABASE_URL'),
+        os.getenv('SUPABASE_KEY')
+    )
+
+    postgrest = client.postgrest
+    default_session = postgrest.session
+    postgrest.session = PooledPostgrestSession(
+        base_url=default_session.base_url,
+        headers=default_session.headers,
+        timeout=httpx.Timeout(
+            SUPABASE_READ_TIMEOUT,
+            connect=SUPABASE_CONNECT_TIMEOUT,
+            pool=SUPABASE_POOL_TIMEOUT
+        ),
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_SECONDS
+        ),
+        http2=SUPABASE_HTTP2,
+        follow_redirects=True
+    )
+    default_session.close()
+    return client
+
+class LazyClient:
+    """Stands in for a client and builds it on first attribute access"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return getattr(client, name)
+
+supabase = LazyClient(create_supabase_client)
+
+# --- Request Metrics ---
+
+# /metrics and /health/details need "Authorization: Bearer <METRICS_TOKEN>";
+# without a token they are disabled
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Server-Timing header on every response: '0' (off), '1' (total handler and
+# database time) or 'tables' (also time per table/RPC, which names the schema)
+SERVER_TIMING = os.getenv('SERVER_TIMING', '0')
+
+class RequestMetrics:
+    """Per-route request counts by status, latency histograms and in-flight gauge"""
+
+    def __init__(self, buckets_ms):
+        self.buckets_ms = buckets_ms
+        self.in_flight = 0
+        self._latency = {}
+        self._statuses = {}
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, route, method, status, elapsed_ms):
+        bucket = next((i for i, bound in enumerate(self.buckets_ms) if elapsed_ms <= bound), len(self.buckets_ms))
+        with self._lock:
+            series = self._latency.get((route, method))
+            if series is None:
+                series = self._latency[(route, method)] = {
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'buckets': [0] * (len(self.buckets_ms) + 1)
+                }
+            series['count'] += 1
+            series['total_ms'] += elapsed_ms
+            series['buckets'][bucket] += 1
+            self._statuses[(route, method, status)] = self._statuses.get((route, method, status), 0) + 1
+
+    def snapshot(self):
+        """Return (latency series, status counts, in-flight) with copied counters"""
+        with self._lock:
+            latency = {key: dict(series, buckets=list(series['buckets'])) for key, series in self._latency.items()}
+            return latency, dict(self._statuses), self.in_flight
+
+request_metrics = RequestMetrics(QueryMetrics.BUCKETS_MS)
+
+db_timing_lock = threading.Lock()
+
+def note_db_time(table, elapsed_ms):
+    """Attribute a PostgREST call to the current request, for Server-Timing"""
+    if not has_request_context():
+        return
+    # Fanned-out queries record from worker threads sharing this request's g
+    with db_timing_lock:
+        timings = g.setdefault('db_timings', {})
+        count, total_ms = timings.get(table, (0, 0.0))
+        timings[table] = (count + 1, total_ms + elapsed_ms)
+
+def server_timing_header(elapsed_ms, db_timings, per_table=False):
+    """'app;dur=12.3, db;dur=8.1;desc="3 calls", db-users;dur=5.0' (Server-Timing metric names are tokens)"""
+    entries = [f'app;dur={elapsed_ms:.1f}']
+    if db_timings:
+        calls = sum(count for count, _ in db_timings.values())
+        total_ms = sum(ms for _, ms in db_timings.values())
+        entries.append(f'db;dur={total_ms:.1f};desc="{calls} calls"')
+    if db_timings and per_table:
+        for table, (count, ms) in sorted(db_timings.items()):
+            entries.append(f"db-{re.sub(r'[^A-Za-z0-9_-]', '-', table)};dur={ms:.1f}")
+    return ', '.join(entries)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.deadline = time.monotonic() + REQUEST_DEADLINE_SECONDS
+    request_metrics.started()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    # The URL rule, not the path, so /api/metaphors/<id> is one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_metrics.record(route, request.method, response.status_code, elapsed_ms)
+    if SERVER_TIMING in ('1', 'tables'):
+        response.headers['Server-Timing'] = server_timing_header(
+            elapsed_ms, g.get('db_timings'), per_table=SERVER_TIMING == 'tables'
+        )
+    return response
+
+@app.teardown_request
+def finish_request(error=None):
+    if g.pop('request_started', None) is not None:
+        request_metrics.finished()
+
+def prometheus_labels(**labels):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+def prometheus_histogram(lines, name, labels, series, buckets_ms):
+    """Append the _bucket/_sum/_count lines of one histogram series (seconds)"""
+    cumulative = 0
+    for bound, count in zip(list(buckets_ms) + ['+Inf'], series['buckets']):
+        cumulative += count
+        le = bound if bound == '+Inf' else f'{bound / 1000:g}'
+        lines.append(f'{name}_bucket{prometheus_labels(**labels, le=le)} {cumulative}')
+    lines.append(f"{name}_sum{prometheus_labels(**labels)} {series['total_ms'] / 1000:.6f}")
+    lines.append(f"{name}_count{prometheus_labels(**labels)} {series['count']}")
+
+def render_metrics():
+    """Prometheus text exposition of request, database, cache and queue metrics"""
+    lines = []
+    latency, statuses, in_flight = request_metrics.snapshot()
+
+    lines.append('# HELP http_requests_total Requests handled, by route, method and status.')
+    lines.append('# TYPE http_requests_total counter')
+    for (route, method, status), count in sorted(statuses.items()):
+        lines.append(f'http_requests_total{prometheus_labels(route=route, method=method, status=status)} {count}')
+
+    lines.append('# HELP http_request_duration_seconds Request latency by route and method.')
+    lines.append('# TYPE http_request_duration_seconds histogram')
+    for (route, method), series in sorted(latency.items()):
+        prometheus_histogram(lines, 'http_request_duration_seconds', {'route': route, 'method': method}, series, request_metrics.buckets_ms)
+
+    lines.append('# HELP http_requests_in_flight Requests currently being handled.')
+    lines.append('# TYPE http_requests_in_flight gauge')
+    lines.append(f'http_requests_in_flight {in_flight}')
+
+    db_series = sorted(db_metrics.snapshot().items())
+    lines.append('# HELP supabase_request_duration_seconds PostgREST call latency by table (or rpc:<name>) and method.')
+    lines.append('# TYPE supabase_request_duration_seconds histogram')
+    for (table, method), series in db_series:
+        prometheus_histogram(lines, 'supabase_request_duration_seconds', {'table': table, 'method': method}, series, QueryMetrics.BUCKETS_MS)
+    lines.append('# HELP supabase_request_errors_total PostgREST calls that failed or returned >= 400.')
+    lines.append('# TYPE supabase_request_errors_total counter')
+    for (table, method), series in db_series:
+        lines.append(f"supabase_request_errors_total{prometheus_labels(table=table, method=method)} {series['errors']}")
+
+    caches = {
+        'session': session_cache,
+        'google_token': google_token_memo,
+        'invite': invite_cache,
+        'submission': submission_cache,
+        'entitlement': entitlement_cache
+    }
+    lines.append('# HELP cache_requests_total In-process cache lookups by result.')
+    lines.append('# TYPE cache_requests_total counter')
+    for name, cache in caches.items():
+        stats = cache.stats()
+        lines.append(f"cache_requests_total{prometheus_labels(cache=name, result='hit')} {stats['hits']}")
+        lines.append(f"cache_requests_total{prometheus_labels(cache=name, result='miss')} {stats['misses']}")
+    lines.append('# HELP cache_entries Entries currently held by each in-process cache.')
+    lines.append('# TYPE cache_entries gauge')
+    for name, cache in caches.items():
+        lines.append(f"cache_entries{prometheus_labels(cache=name)} {cache.stats()['size']}")
+
+    lines.append('# HELP rate_limit_requests_total Rate-limited requests by route and outcome.')
+    lines.append('# TYPE rate_limit_requests_total counter')
+    for route, counts in sorted(rate_limiter.stats().items()):
+        for outcome, count in sorted(counts.items()):
+            lines.append(f'rate_limit_requests_total{prometheus_labels(route=route, outcome=outcome)} {count}')
+
+    queues = {'stripe_webhook': webhook_queue.stats(), 'write_buffer': write_buffer.stats()}
+    lines.append('# HELP background_queue_events_total Background queue events by outcome.')
+    lines.append('# TYPE background_queue_events_total counter')
+    for name, stats in queues.items():
+        for outcome, count in sorted(stats.items()):
+            if outcome not in ('depth', 'pending', 'retrying'):
+                lines.append(f'background_queue_events_total{prometheus_labels(queue=name, outcome=outcome)} {count}')
+    lines.append('# HELP background_queue_depth Items waiting in each background queue.')
+    lines.append('# TYPE background_queue_depth gauge')
+    lines.append(f"background_queue_depth{prometheus_labels(queue='stripe_webhook')} {queues['stripe_webhook']['depth']}")
+    lines.append(f"background_queue_depth{prometheus_labels(queue='write_buffer')} {queues['write_buffer']['pending']}")
+
+    return '\n'.join(lines) + '\n'
+
+# --- Concurrent Queries ---
+
+# Independent Supabase queries within a request run in parallel on a shared
+# pool (kept below SUPABASE_MAX_CONNECTIONS); a request gives up waiting on
+# them once it is REQUEST_DEADLINE_SECONDS old
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', '8'))
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '8'))
+
+fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+
+class DeadlineExceeded(Exception):
+    pass
+
+def fan_out(*calls):
+    """Run independent callables concurrently and return their results in order.
+
+    The first call runs on the calling thread, which keeps nested fan-outs
+    from waiting on a saturated pool. The others run on the shared pool, each
+    in a copy of the caller's context so request-scoped state (g,
+    Server-Timing) still works. Inside a request, the deadline is checked
+    before and after the inline call and bounds the wait on the others. A
+    call's exception is re-raised here.
+    """
+    deadline = g.get('deadline') if has_request_context() else None
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded('Request deadline exceeded')
+
+    futures = [fanout_executor.submit(contextvars.copy_context().run, call) for call in calls[1:]]
+    try:
+        results = [calls[0]()]
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded('Request deadline exceeded')
+        for future in futures:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            results.append(future.result(timeout=timeout))
+        return results
+    except FutureTimeoutError:
+        raise DeadlineExceeded('Request deadline exceeded')
+    finally:
+        for future in futures:
+            future.cancel()
 
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+GOOGLE_ISSUERS = ['accounts.google.com', 'https://accounts.google.com']
+GOOGLE_CERTS_URL = os.getenv('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+# Optional local {key_id: PEM} file used instead of GOOGLE_CERTS_URL (offline testing)
+GOOGLE_CERTS_FILE = os.getenv('GOOGLE_CERTS_FILE')
+# Recently verified ID tokens (by hash) skip signature checks for this long
+GOOGLE_TOKEN_MEMO_SECONDS = int(os.getenv('GOOGLE_TOKEN_MEMO_SECONDS', '300'))
 SESSION_DURATION_DAYS = 30
 
+# Verified sessions are cached per process and re-checked against the
+# sessions table after this window, so a logout on another worker is
+# picked up within SESSION_CACHE_TTL_SECONDS at most.
+SESSION_CACHE_TTL_SECONDS = int(os.getenv('SESSION_CACHE_TTL_SECONDS', '60'))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', '10000'))
+
+# Expired session rows are purged in batches this often (0 disables the thread)
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.getenv('SESSION_SWEEP_INTERVAL_SECONDS', '3600'))
+SESSION_SWEEP_BATCH_SIZE = 1000
+
+# SESSION_MODE=signed issues stateless HMAC-signed tokens instead of sessions rows.
+# SESSION_SIGNING_KEYS is 'key_id:secret,...'; the first key signs, all keys verify.
+SESSION_MODE = os.getenv('SESSION_MODE', 'database')
+SESSION_SIGNING_KEYS = [
+    tuple(entry.strip().split(':', 1))
+    for entry in os.getenv('SESSION_SIGNING_KEYS', '').split(',')
+    if ':' in entry
+]
+SESSION_REVOCATION_SYNC_SECONDS = int(os.getenv('SESSION_REVOCATION_SYNC_SECONDS', '30'))
+# Revocations are read a page at a time; must not exceed PostgREST's max-rows
+SESSION_REVOCATION_PAGE_SIZE = 1000
+if SESSION_MODE == 'signed' and not SESSION_SIGNING_KEYS:
+    raise RuntimeError('SESSION_MODE=signed requires SESSION_SIGNING_KEYS')
+
+# The metaphor/bundle catalog is served from memory and reloaded in the
+# background once it is older than CATALOG_REFRESH_SECONDS.
+CATALOG_REFRESH_SECONDS = int(os.getenv('CATALOG_REFRESH_SECONDS', '300'))
+CATALOG_MAX_AGE_SECONDS = int(os.getenv('CATALOG_MAX_AGE_SECONDS', '60'))
+
+# GET /api/metaphors returns gallery card fields by default. `fields=` may
+# pick from METAPHOR_LIST_FIELDS; full_content is never listed.
+METAPHOR_CARD_FIELDS = ('id', 'title', 'symbol', 'keywords', 'doctrine', 'price', 'status', 'order_index')
+METAPHOR_LIST_FIELDS = METAPHOR_CARD_FIELDS + ('preview_content',)
+METAPHOR_PAGE_MAX = 100
+
+# Per-user sets of owned metaphor ids. Purchases handled by this process
+# update the set in place; purchases recorded elsewhere show up once the
+# entry ages out.
+ENTITLEMENT_CACHE_TTL_SECONDS = int(os.getenv('ENTITLEMENT_CACHE_TTL_SECONDS', '60'))
+ENTITLEMENT_CACHE_MAX_USERS = int(os.getenv('ENTITLEMENT_CACHE_MAX_USERS', '5000'))
+LIBRARY_MAX_BATCH_IDS = 100
+
+# Interview invites are re-read after this many seconds
+INVITE_CACHE_TTL_SECONDS = int(os.getenv('INVITE_CACHE_TTL_SECONDS', '30'))
+INVITE_CACHE_MAX_ENTRIES = 1000
+
 # Stripe configuration
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_WEBHOOK_WORKERS = int(os.getenv('STRIPE_WEBHOOK_WORKERS', '2'))
+STRIPE_WEBHOOK_BATCH_SIZE = int(os.getenv('STRIPE_WEBHOOK_BATCH_SIZE', '50'))
+STRIPE_WEBHOOK_MAX_ATTEMPTS = int(os.getenv('STRIPE_WEBHOOK_MAX_ATTEMPTS', '8'))
+STRIPE_WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv('STRIPE_WEBHOOK_RETRY_BASE_SECONDS', '2'))
+# A process holds each event it is fulfilling (or retrying) for this long; an
+# event whose holder went away is claimed by the recovery sweep, run this often.
+# Keep the hold above the 300s cap on retry backoff.
+STRIPE_WEBHOOK_CLAIM_SECONDS = int(os.getenv('STRIPE_WEBHOOK_CLAIM_SECONDS', '900'))
+STRIPE_WEBHOOK_RECOVER_SECONDS = int(os.getenv('STRIPE_WEBHOOK_RECOVER_SECONDS', '60'))
+# Fulfil on worker threads after acknowledging; off on serverless hosts, where
+# the webhook fulfils the event itself before answering
+STRIPE_WEBHOOK_BACKGROUND = os.getenv('STRIPE_WEBHOOK_BACKGROUND', '0' if os.getenv('VERCEL') else '1') == '1'
+
+# Form submissions (subscriptions, suggestions, feedback) are buffered and
+# bulk-inserted every WRITE_BUFFER_FLUSH_ROWS rows or WRITE_BUFFER_FLUSH_MS,
+# whichever comes first. Unflushed rows are spilled to WRITE_BUFFER_SPILL_DIR
+# and replayed by the next process if this one dies. Serverless instances
+# (VERCEL is set) can be frozen as soon as the response is sent, so there the
+# row is written before the request returns unless WRITE_BUFFER_BACKGROUND=1.
+WRITE_BUFFER_BACKGROUND = os.getenv('WRITE_BUFFER_BACKGROUND', '0' if os.getenv('VERCEL') else '1') == '1'
+WRITE_BUFFER_FLUSH_ROWS = int(os.getenv('WRITE_BUFFER_FLUSH_ROWS', '100'))
+WRITE_BUFFER_FLUSH_MS = int(os.getenv('WRITE_BUFFER_FLUSH_MS', '500'))
+WRITE_BUFFER_MAX_ATTEMPTS = int(os.getenv('WRITE_BUFFER_MAX_ATTEMPTS', '10'))
+WRITE_BUFFER_SPILL_DIR = os.getenv('WRITE_BUFFER_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'write-buffer'))
+
+# Subscribed emails are kept in a local hash set so repeat signups are rejected
+# without a database round trip; reloaded in the background this often
+SUBSCRIPTION_INDEX_REFRESH_SECONDS = int(os.getenv('SUBSCRIPTION_INDEX_REFRESH_SECONDS', '600'))
+SUBSCRIPTION_INDEX_PAGE_SIZE = 1000
+
+# Token-bucket limits for the write endpoints, as "<requests>/<seconds>".
+# Override one with RATE_LIMIT_<NAME>, e.g. RATE_LIMIT_SUBSCRIBE=20/60.
+# Buckets live in process memory unless RATE_LIMIT_REDIS_URL is set, in
+# which case every process shares them (requires the redis package).
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+RATE_LIMIT_MAX_KEYS = 100000
+RATE_LIMITS = {
+    'auth_google': '20/60',
+    'subscribe': '5/60',
+    'suggestion': '5/60',
+    'feedback': '10/60',
+    'interview_create': '10/60'
+}
+
+# Output of build_assets.py; when present, assets are served fingerprinted and precompressed
+STATIC_BUILD_DIR = os.getenv('STATIC_BUILD_DIR', os.path.join(os.path.dirname(__file__), 'build', 'static'))
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Output of build_media.py; responsive WebP/AVIF variants negotiated per request
+MEDIA_BUILD_DIR = os.getenv('MEDIA_BUILD_DIR', os.path.join(os.path.dirname(__file__), 'build', 'media'))
+
+# HTML pages are read once and kept in memory; set to 1 to reload edited files
+PAGE_CACHE_RELOAD = os.getenv('PAGE_CACHE_RELOAD', '0') == '1'
 
 # --- Interview Questions Config ---
 # Load questions from external JSON file
+INTERVIEW_QUESTIONS_FILE = os.path.join(os.path.dirname(__file__), 'interview_questions.json')
+# How often the questions file is checked for edits
+INTERVIEW_QUESTIONS_CHECK_SECONDS = int(os.getenv('INTERVIEW_QUESTIONS_CHECK_SECONDS', '5'))
+
 def load_interview_questions():
-    questions_file = os.path.join(os.path.dirname(__file__), 'interview_questions.json')
-    with open(questions_file, 'r') as f:
+    with open(INTERVIEW_QUESTIONS_FILE, 'r') as f:
         return json.load(f)
 
-INTERVIEW_QUESTIONS = load_interview_questions()
+def normalize_position(position):
+    """Case- and whitespace-insensitive key for a position name"""
+    return ' '.join(position.split()).casefold()
+
+class QuestionStore:
+    """Interview questions pre-serialized per position, reloaded when the JSON file changes"""
+
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+        self._mtime = None
+        self._checked_at = 0.0
+        self._by_position = {}
+        self._not_found = None
+        self._lock = threading.Lock()
+
+    def _encode(self, payload):
+        body = app.json.dumps(payload).encode('utf-8')
+        return body, hashlib.sha256(body).hexdigest()[:32]
+
+    def _load(self, mtime):
+        questions = load_interview_questions()
+        by_position = {normalize_position(name): self._encode(payload) for name, payload in questions.items()}
+        not_found = app.json.dumps({
+            'error': 'Position not found',
+            'available_positions': list(questions.keys())
+        }).encode('utf-8')
+
+        self._by_position, self._not_found, self._mtime = by_position, not_found, mtime
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked_at < self.check_seconds:
+            return
+        with self._lock:
+            if self._mtime is not None and now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(INTERVIEW_QUESTIONS_FILE)
+                if mtime != self._mtime:
+                    self._load(mtime)
+            except (OSError, ValueError) as e:
+                # Keep serving the last good copy while the file is mid-edit or
+                # briefly missing (an editor's atomic save)
+                if self._mtime is None:
+                    raise
+                print(f"Interview questions reload failed: {e}")
+
+    def get(self, position):
+        """Return (body, etag) for a position, or None if unknown"""
+        self._refresh()
+        return self._by_position.get(normalize_position(position))
+
+    def not_found_body(self):
+        self._refresh()
+        return self._not_found
+
+interview_questions = QuestionStore(INTERVIEW_QUESTIONS_CHECK_SECONDS)
+
+# --- In-process Caches ---
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL"""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds=None):
+        """Store a value, evicting the least recently used entry when full"""
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update(self, key, fn):
+        """Replace a live entry with fn(value), keeping its expiry; no-op if absent"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries[key] = (entry[0], fn(entry[1]))
+
+    def pop(self, key):
+        """Evict a single entry"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# token -> (user_uuid, expires_at)
+session_cache = TTLCache(SESSION_CACHE_MAX_ENTRIES, SESSION_CACHE_TTL_SECONDS)
+
+# sha256(Google ID token) -> verified Google user info
+google_token_memo = TTLCache(1000, GOOGLE_TOKEN_MEMO_SECONDS)
+
+# interview token -> interview_invites row
+invite_cache = TTLCache(INVITE_CACHE_MAX_ENTRIES, INVITE_CACHE_TTL_SECONDS)
+
+# (interview token, idempotency key) -> True once that submission succeeded
+submission_cache = TTLCache(INVITE_CACHE_MAX_ENTRIES, 24 * 60 * 60)
+
+# user_uuid -> frozenset of owned metaphor ids
+entitlement_cache = TTLCache(ENTITLEMENT_CACHE_MAX_USERS, ENTITLEMENT_CACHE_TTL_SECONDS)
 
 # --- Authentication Helpers ---
 
+class GoogleCertCache:
+    """Google's ID token signing certificates, refetched when their Cache-Control max-age runs out"""
+
+    DEFAULT_MAX_AGE_SECONDS = 3600
+    # Unknown key ids force a refetch at most this often, so bogus tokens cannot hammer Google
+    MIN_REFRESH_SECONDS = 60
+
+    def __init__(self, certs_url, certs_file=None):
+        self.certs_url = certs_url
+        self.certs_file = certs_file
+        self.fetches = 0
+        self._certs = None
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        if self.certs_file:
+            with open(self.certs_file, 'r') as f:
+                return json.load(f), float('inf')
+
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        response = self._session.get(self.certs_url, timeout=5)
+        response.raise_for_status()
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        max_age = int(match.group(1)) if match else self.DEFAULT_MAX_AGE_SECONDS
+        return response.json(), max_age
+
+    def _fresh(self, force_refresh):
+        if self._certs is None:
+            return False
+        now = time.monotonic()
+        if force_refresh:
+            return now - self._fetched_at < self.MIN_REFRESH_SECONDS
+        return now < self._expires_at
+
+    def get(self, force_refresh=False):
+        """Return {key_id: certificate}, fetching only when expired or forced"""
+        if self._fresh(force_refresh):
+            return self._certs
+        with self._lock:
+            if self._fresh(force_refresh):
+                return self._certs
+            certs, max_age = self._fetch()
+            self.fetches += 1
+            self._certs = certs
+            self._fetched_at = time.monotonic()
+            self._expires_at = self._fetched_at + max_age
+            return certs
+
+google_certs = GoogleCertCache(GOOGLE_CERTS_URL, GOOGLE_CERTS_FILE)
+
+def decode_google_token(token):
+    """Check an ID token's signature, audience and expiry against the cached certificates"""
+    from google.auth import jwt as google_jwt
+
+    try:
+        return google_jwt.decode(token, certs=google_certs.get(), audience=GOOGLE_CLIENT_ID)
+    except ValueError as e:
+        # Google rotated its keys since the certificates were cached
+        if 'Certificate for key id' not in str(e):
+            raise
+        return google_jwt.decode(token, certs=google_certs.get(force_refresh=True), audience=GOOGLE_CLIENT_ID)
+
 def verify_google_token(token):
     """Verify Google ID token and return user info"""
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    cached = google_token_memo.get(token_hash)
+    if cached:
+        return cached
+
     try:
-        idinfo = id_token.verify_oauth2_token(
-            token,
-            google_requests.Request(),
-            GOOGLE_CLIENT_ID
-        )
+        idinfo = decode_google_token(token)
 
-        if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
+        if idinfo['iss'] not in GOOGLE_ISSUERS:
             return None
 
-        return {
+        google_user = {
             'google_id': idinfo['sub'],
             'email': idinfo['email'],
             'name': idinfo.get('name'),
             'avatar_url': idinfo.get('picture')
         }
+        google_token_memo.set(token_hash, google_user, idinfo['exp'] - time.time())
+        return google_user
     except Exception as e:
         print(f"Google token verification failed: {e}")
         return None
 
-def create_session(user_uuid, google_id=None):
-    """Create a new session token for user"""
-    token = secrets.token_urlsafe(64)
+def login_google_user(google_user):
+    """Upsert the user and issue a session in one round trip.
+
+    The login_google_user RPC inserts the user (or refreshes its name on
+    google_id conflict) and stores the session row in the same transaction.
+    In signed session mode no row is stored and a signed token is returned.
+    Returns (user, token, expires_at).
+    """
     expires_at = datetime.utcnow() + timedelta(days=SESSION_DURATION_DAYS)
+    # Signed sessions need no sessions row; the RPC then only upserts the user
+    token = None if SESSION_MODE == 'signed' else secrets.token_urlsafe(64)
+
+    result = supabase.rpc('login_google_user', {
+        'p_google_id': google_user['google_id'],
+        'p_email': google_user['email'],
+        'p_name': google_user['name'],
+        'p_token': token,
+        'p_expires_at': expires_at.isoformat()
+    }).execute()
+    user = result.data
+
+    if token is None:
+        return user, create_signed_session(user['uuid'], expires_at), expires_at
 
-    session_data = {
-        'user_uuid': str(user_uuid),
-        'token': token,
-        'expires_at': expires_at.isoformat()
+    cache_session(token, str(user['uuid']), expires_at)
+    session_sweeper.start()
+    return user, token, expires_at
+
+def cache_session(token, user_uuid, expires_at):
+    """Remember a verified session until it expires or needs revalidation"""
+    now = datetime.now(expires_at.tzinfo) if expires_at.tzinfo else datetime.utcnow()
+    remaining = (expires_at - now).total_seconds()
+    session_cache.set(token, (user_uuid, expires_at), remaining)
+
+# --- Signed Sessions ---
+
+SIGNED_TOKEN_PREFIX = 'v1.'
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(key_id, payload):
+    secret = dict(SESSION_SIGNING_KEYS).get(key_id)
+    if secret is None:
+        return None
+    message = f'{SIGNED_TOKEN_PREFIX}{key_id}.{payload}'.encode('ascii')
+    return _b64encode(hmac.new(secret.encode('utf-8'), message, hashlib.sha256).digest())
+
+def create_signed_session(user_uuid, expires_at):
+    """Issue a stateless token: v1.<key_id>.<claims>.<HMAC-SHA256 signature>"""
+    key_id = SESSION_SIGNING_KEYS[0][0]
+    claims = {
+        'u': str(user_uuid),
+        'exp': int(expires_at.replace(tzinfo=timezone.utc).timestamp()),
+        'jti': secrets.token_urlsafe(12)
     }
-    if google_id:
-        session_data['google_id'] = google_id
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f'{SIGNED_TOKEN_PREFIX}{key_id}.{payload}.{_sign(key_id, payload)}'
+
+def signed_session_claims(token):
+    """Return the claims of a correctly signed, unexpired token, else None"""
+    if not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        key_id, payload, signature = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        expected = _sign(key_id, payload)
+        if expected is None or not hmac.compare_digest(expected, signature):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims['exp'] <= time.time():
+        return None
+    return claims
+
+class RevocationList:
+    """Ids of signed tokens revoked by logout, synced from revoked_sessions in the background.
+
+    The first check in a process loads the list before answering. Until a
+    load succeeds, each check asks the database about that one token, and a
+    token that can't be checked counts as revoked. Later syncs only read
+    rows added since the sync before last, paging by id.
+    """
+
+    def __init__(self, sync_seconds, page_size):
+        self.sync_seconds = sync_seconds
+        self.page_size = page_size
+        self._revoked = {}
+        self._seen_id = 0
+        self._previous_seen_id = 0
+        self._loaded = False
+        self._synced_at = None
+        self._syncing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _fetch(self):
+        # Starting a sync further back than the last id seen also catches a
+        # row whose id was assigned before, but committed after, that one
+        last_id = self._previous_seen_id
+        unexpired = datetime.utcnow().isoformat()
+        revoked = {}
+        while True:
+            result = supabase.table('revoked_sessions')\
+                .select('id, jti, expires_at')\
+                .gt('id', last_id)\
+                .gt('expires_at', unexpired)\
+                .order('id')\
+                .limit(self.page_size)\
+                .execute()
+            for row in result.data:
+                expires = datetime.fromisoformat(row['expires_at'].replace('Z', '+00:00'))
+                revoked[row['jti']] = expires.replace(tzinfo=expires.tzinfo or timezone.utc).timestamp()
+            if result.data:
+                last_id = result.data[-1]['id']
+            if len(result.data) < self.page_size:
+                break
+
+        now = time.time()
+        with self._lock:
+            self._revoked.update(revoked)
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            last_id = max(last_id, self._seen_id)
+            self._previous_seen_id = self._seen_id if self._loaded else last_id
+            self._seen_id = last_id
+            self._loaded = True
+            self._synced_at = time.monotonic()
+
+    def _sync(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            print(f"Revocation list sync failed: {e}")
+        finally:
+            self._synced_at = time.monotonic()
+            self._syncing = False
+
+    def _load(self):
+        with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                self._fetch()
+            except Exception as e:
+                print(f"Revocation list load failed: {e}")
+
+    def _check_database(self, jti):
+        try:
+            result = supabase.table('revoked_sessions')\
+                .select('jti')\
+                .eq('jti', jti)\
+                .execute()
+            return bool(result.data)
+        except Exception as e:
+            print(f"Revocation check failed: {e}")
+            return True
+
+    def is_revoked(self, jti):
+        if not self._loaded:
+            self._load()
+            if not self._loaded:
+                return jti in self._revoked or self._check_database(jti)
+        elif time.monotonic() - self._synced_at > self.sync_seconds:
+            with self._lock:
+                start_sync = not self._syncing
+                self._syncing = True
+            if start_sync:
+                threading.Thread(target=self._sync, daemon=True).start()
+        return jti in self._revoked
+
+    def revoke(self, claims):
+        """Revoke a token in this process immediately and record it for the others"""
+        with self._lock:
+            self._revoked[claims['jti']] = claims['exp']
+        # A second logout of the same session (here or in another process) is a no-op
+        supabase.table('revoked_sessions').upsert({
+            'jti': claims['jti'],
+            'user_uuid': claims['u'],
+            'expires_at': datetime.fromtimestamp(claims['exp'], timezone.utc).isoformat()
+        }, on_conflict='jti', ignore_duplicates=True).execute()
+
+revoked_sessions = RevocationList(SESSION_REVOCATION_SYNC_SECONDS, SESSION_REVOCATION_PAGE_SIZE)
+
+class SessionSweeper:
+    """Background thread that deletes expired sessions in batches"""
+
+    def __init__(self, interval_seconds, batch_size):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.removed = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def sweep(self):
+        """Delete expired sessions until a batch comes back short; return the number removed"""
+        removed = 0
+        while True:
+            result = supabase.rpc('purge_expired_sessions', {'p_batch_size': self.batch_size}).execute()
+            deleted = result.data or 0
+            removed += deleted
+            if deleted < self.batch_size:
+                break
+        with self._lock:
+            self.removed += removed
+        return removed
+
+    def _run(self):
+        while True:
+            try:
+                removed = self.sweep()
+                if removed:
+                    print(f"Removed {removed} expired sessions")
+            except Exception as e:
+                print(f"Session sweep failed: {e}")
+            time.sleep(self.interval_seconds)
 
-    supabase.table('sessions').insert(session_data).execute()
+    def start(self):
+        with self._lock:
+            if self._started or self.interval_seconds <= 0:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name='session-sweeper', daemon=True).start()
 
-    return token, expires_at
+session_sweeper = SessionSweeper(SESSION_SWEEP_INTERVAL_SECONDS, SESSION_SWEEP_BATCH_SIZE)
 
 def verify_session(token):
     """Verify session token and return user_id if valid"""
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        claims = signed_session_claims(token)
+        if claims and not revoked_sessions.is_revoked(claims['jti']):
+            return claims['u']
+        return None
+
+    cached = session_cache.get(token)
+    if cached:
+        return cached[0]
+
     try:
         result = supabase.table('sessions')\
             .select('user_uuid, expires_at')\
@@ -91,6 +1006,7 @@ def verify_session(token):
             session = result.data[0]
             expires_at = datetime.fromisoformat(session['expires_at'].replace('Z', '+00:00'))
             if expires_at > datetime.now(expires_at.tzinfo):
+                cache_session(token, session['user_uuid'], expires_at)
                 return session['user_uuid']
     except Exception as e:
         print(f"Session verification failed: {e}")
@@ -112,82 +1028,977 @@ def require_auth(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def get_optional_user_id():
+    """Return the user_id for a valid bearer token, or None for anonymous requests"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    return verify_session(token) if token else None
+
+# --- Rate Limiting ---
+
+def parse_rate(spec):
+    """'10/60' -> (capacity 10, refill 10/60 tokens per second)"""
+    count, seconds = spec.split('/')
+    return int(count), int(count) / float(seconds)
+
+class MemoryBucketStore:
+    """Token buckets in process memory, least recently used evicted past max_keys"""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_per_second):
+        """Spend one token; return (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / refill_per_second
+
+class RedisBucketStore:
+    """Token buckets shared by every process through Redis, updated atomically in Lua"""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATE_LIMIT_REDIS_URL is set but the redis package is not installed')
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, refill_per_second):
+        allowed, tokens = self._script(keys=[f'ratelimit:{key}'], args=[capacity, refill_per_second, time.time()])
+        allowed = bool(int(allowed))
+        return allowed, 0 if allowed else (1 - float(tokens)) / refill_per_second
+
+class RateLimiter:
+    """Per-route token-bucket limits with shed counters.
+
+    When the shared store fails, the request is checked against the
+    per-process fallback store instead (or let through if there is none),
+    rather than taking the endpoints down with it. Failures are counted as
+    errors.
+    """
+
+    def __init__(self, store, limits, enabled=True, fallback=None):
+        self.store = store
+        self.fallback = fallback
+        self.enabled = enabled
+        self.limits = {name: parse_rate(os.getenv(f'RATE_LIMIT_{name.upper()}', spec)) for name, spec in limits.items()}
+        self.counters = {name: {'allowed': 0, 'shed': 0, 'errors': 0} for name in limits}
+        self._lock = threading.Lock()
+
+    def _count(self, name, outcome):
+        with self._lock:
+            self.counters[name][outcome] += 1
+
+    def check(self, name, key):
+        """Return None if the request may proceed, else the seconds to wait"""
+        capacity, refill_per_second = self.limits[name]
+        try:
+            allowed, retry_after = self.store.take(f'{name}:{key}', capacity, refill_per_second)
+        except Exception as e:
+            print(f"Rate limit store failed: {e}")
+            self._count(name, 'errors')
+            if self.fallback is None:
+                return None
+            allowed, retry_after = self.fallback.take(f'{name}:{key}', capacity, refill_per_second)
+
+        self._count(name, 'allowed' if allowed else 'shed')
+        return None if allowed else retry_after
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(counts) for name, counts in self.counters.items()}
+
+def known_session_user(token):
+    """The user a token belongs to if this process can tell without a database call, else None"""
+    claims = signed_session_claims(token)
+    if claims:
+        return claims['u']
+    cached = session_cache.get(token)
+    return cached[0] if cached else None
+
+def rate_limit_key(key_by):
+    """Identify the caller: 'ip', 'token' (bearer token, else ip) or 'user' (session user, else ip).
+
+    Never touches the database, so a shed request costs no round trip: a
+    session token this process hasn't verified yet is keyed by ip.
+    """
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if key_by == 'token' and token:
+        return 'token:' + hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+    if key_by == 'user' and token:
+        user_id = known_session_user(token)
+        if user_id:
+            return f'user:{user_id}'
+    return f'ip:{request.remote_addr}'
+
+def rate_limited(name, key_by='ip'):
+    """Decorator applying the named limit from RATE_LIMITS; sheds with 429 and Retry-After"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if rate_limiter.enabled:
+                retry_after = rate_limiter.check(name, rate_limit_key(key_by))
+                if retry_after is not None:
+                    response = jsonify({'error': 'Too many requests, please try again later'})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                    return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+rate_limiter = RateLimiter(
+    RedisBucketStore(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryBucketStore(RATE_LIMIT_MAX_KEYS),
+    RATE_LIMITS,
+    RATE_LIMIT_ENABLED,
+    fallback=MemoryBucketStore(RATE_LIMIT_MAX_KEYS) if RATE_LIMIT_REDIS_URL else None
+)
+
+# --- Static Assets ---
+
+def load_asset_manifest():
+    manifest_file = os.path.join(STATIC_BUILD_DIR, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return {'files': {}, 'pages': [], 'encodings': {}}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+def load_media_manifest():
+    manifest_file = os.path.join(MEDIA_BUILD_DIR, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return {'originals': {}, 'variants': {}}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+ASSET_MANIFEST = load_asset_manifest()
+BUILT_PAGES = set(ASSET_MANIFEST['pages'])
+HASHED_ASSETS = set(ASSET_MANIFEST['files'].values())
+ASSET_SOURCES = {hashed: source for source, hashed in ASSET_MANIFEST['files'].items()}
+
+MEDIA_MANIFEST = load_media_manifest()
+MEDIA_FILES = {entry['path']: entry['type'] for entries in MEDIA_MANIFEST['variants'].values() for entry in entries}
+
+def send_built(path):
+    """Serve a file from the build output, choosing a precompressed variant if accepted"""
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in ASSET_MANIFEST['encodings'].get(path, []) and encoding in request.accept_encodings:
+            response = send_from_directory(STATIC_BUILD_DIR, path + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(STATIC_BUILD_DIR, path, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def compressed_variants(body):
+    """Return {encoding: (body, etag)} for a page body, plain plus any smaller gzip/br copies"""
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    # Each encoding is a different representation, so each gets its own ETag
+    variants = {None: (body, etag)}
+    gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(gzipped) < len(body):
+        variants['gzip'] = (gzipped, etag + '-gz')
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=11)
+        if len(compressed) < len(body):
+            variants['br'] = (compressed, etag + '-br')
+    return variants
+
+def prebuilt_variants(path, body, encodings):
+    """Like compressed_variants, but reading the .gz/.br siblings build_assets.py wrote"""
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    variants = {None: (body, etag)}
+    for encoding, suffix in (('gzip', '.gz'), ('br', '.br')):
+        if encoding in encodings:
+            with open(path + suffix, 'rb') as f:
+                variants[encoding] = (f.read(), f'{etag}-{suffix[1:]}')
+    return variants
+
+class Page:
+    """An HTML page held in memory with precompressed bodies and a strong ETag.
+
+    `encodings` lists the compressed siblings already on disk for a built
+    page; without it the page is compressed here.
+    """
+
+    def __init__(self, path, encodings=None):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            body = f.read()
+        if encodings is None:
+            self.variants = compressed_variants(body)
+        else:
+            self.variants = prebuilt_variants(path, body, encodings)
+
+    def is_stale(self):
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return True
+
+class PageRegistry:
+    """Loads views/*.html once per process and serves them from memory.
+
+    With PAGE_CACHE_RELOAD=1 (or under app.debug) each request re-checks the
+    file's mtime and reloads edited pages.
+    """
+
+    def __init__(self, reload):
+        self.reload = reload
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _source(self, filename):
+        """Return (path, prebuilt encodings or None) for a views/ filename"""
+        built = f'views/{filename}'
+        if built in BUILT_PAGES:
+            return safe_join(os.path.join(STATIC_BUILD_DIR, 'views'), filename), ASSET_MANIFEST['encodings'].get(built, [])
+        return safe_join(os.path.join(app.root_path, 'views'), filename), None
+
+    def get(self, filename):
+        """Return the Page for a views/ filename, or None if it does not exist"""
+        page = self._pages.get(filename)
+        if page is not None and not ((self.reload or app.debug) and page.is_stale()):
+            return page
+
+        path, encodings = self._source(filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        page = Page(path, encodings)
+        with self._lock:
+            self._pages[filename] = page
+        return page
+
+pages = PageRegistry(PAGE_CACHE_RELOAD)
+
+def send_html(variants, cache_control='no-cache'):
+    """Serve the best accepted variant of an HTML body, answering conditional GETs"""
+    encoding = next((e for e in ('br', 'gzip') if e in variants and e in request.accept_encodings), None)
+    body, etag = variants[encoding]
+
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+def send_page(filename):
+    """Serve an HTML page from memory, precompressed and answering conditional GETs"""
+    page = pages.get(filename)
+    if page is None:
+        abort(404)
+    return send_html(page.variants)
+
+def pick_media_variant(source):
+    """Pick the smallest image variant the client accepts at the requested ?w= width.
+
+    Returns None when the original file is the best choice.
+    """
+    original = MEDIA_MANIFEST['originals'][source]
+    try:
+        width = int(request.args.get('w', 0))
+    except ValueError:
+        width = 0
+    if width <= 0 or width > original['width']:
+        width = original['width']
+
+    # Only formats the client names explicitly; */* does not imply WebP/AVIF support
+    accepted = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+    candidates = [
+        v for v in MEDIA_MANIFEST['variants'][source]
+        if v['width'] >= width and (v['type'] in accepted or v['type'] == original['type'])
+    ]
+    best = min(candidates, key=lambda v: v['bytes'], default=None)
+    if best is None or best['bytes'] >= original['bytes']:
+        return None
+    return best
+
+def send_media(path, source):
+    """Serve an image as the best variant for this client, varying on Accept"""
+    variant = pick_media_variant(source)
+    if variant:
+        response = send_from_directory(MEDIA_BUILD_DIR, variant['path'], mimetype=variant['type'])
+    elif path in HASHED_ASSETS:
+        response = send_built(path)
+    else:
+        directory, filename = path.split('/', 1)
+        response = send_from_directory(directory, filename)
+
+    response.vary.add('Accept')
+    if path in HASHED_ASSETS:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+def send_asset(directory, filename):
+    """Serve a static file; fingerprinted build outputs are cached as immutable"""
+    path = f'{directory}/{filename}'
+    source = ASSET_SOURCES.get(path, path)
+    if source in MEDIA_MANIFEST['variants']:
+        return send_media(path, source)
+    if path in MEDIA_FILES:
+        response = send_from_directory(MEDIA_BUILD_DIR, path, mimetype=MEDIA_FILES[path])
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+    if path in HASHED_ASSETS:
+        response = send_built(path)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+    if directory == 'views' and filename.endswith('.html'):
+        return send_page(filename)
+    return send_from_directory(directory, filename)
+
+# --- Catalog Store ---
+
+def cached_json_response(body, etag, max_age=CATALOG_MAX_AGE_SECONDS):
+    """Serve pre-serialized JSON with a strong ETag, answering If-None-Match with 304"""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, stale-while-revalidate={max_age * 5}'
+    return response.make_conditional(request)
+
+def metaphor_sort_key(metaphor):
+    """Catalog order: order_index (unset last), then id"""
+    order_index = metaphor.get('order_index')
+    return (order_index is None, order_index or 0, str(metaphor['id']))
+
+class CatalogSnapshot:
+    """Immutable view of the metaphors and bundles tables, indexed by id"""
+
+    def __init__(self, metaphors, bundles, version):
+        self.version = version
+        self.metaphors = metaphors
+        self.metaphors_by_id = {m['id']: m for m in metaphors}
+        self.metaphor_keys = [metaphor_sort_key(m) for m in metaphors]
+        self.bundles = bundles
+        self.bundles_by_id = {b['id']: b for b in bundles}
+        self.active_bundles = [b for b in bundles if b.get('status') == 'active']
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, key, build):
+        """Return (body, etag) for a payload, serializing it once per snapshot"""
+        cached = self._encoded.get(key)
+        if cached is None:
+            body = app.json.dumps(build()).encode('utf-8')
+            cached = (body, hashlib.sha256(body).hexdigest()[:32])
+            with self._lock:
+                self._encoded[key] = cached
+        return cached
+
+    def rendered(self, key, build):
+        """Return a value (e.g. a rendered page) built once per snapshot"""
+        cached = self._encoded.get(key)
+        if cached is None:
+            cached = build()
+            with self._lock:
+                self._encoded[key] = cached
+        return cached
+
+class CatalogStore:
+    """Process-level metaphor/bundle catalog with stale-while-revalidate refresh"""
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self.loads = 0
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        metaphors, bundles = fan_out(
+            lambda: supabase.table('metaphors')
+                .select('*')
+                .order('order_index')
+                .execute(),
+            lambda: supabase.table('bundles')
+                .select('*')
+                .execute()
+        )
+
+        metaphors = sorted(metaphors.data or [], key=metaphor_sort_key)
+        with self._lock:
+            self.loads += 1
+            self._snapshot = CatalogSnapshot(metaphors, bundles.data or [], self.loads)
+            self._loaded_at = time.monotonic()
+            return self._snapshot
+
+    def _refresh_in_background(self):
+        try:
+            self._load()
+        except Exception as e:
+            print(f"Catalog refresh failed: {e}")
+        finally:
+            self._refreshing = False
+
+    def get(self):
+        """Return the current snapshot, loading it on first use"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            # One cold load per process; concurrent first requests wait for it
+            with self._load_lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    return self._load()
+
+        if time.monotonic() - self._loaded_at > self.refresh_seconds:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return snapshot
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+catalog = CatalogStore(CATALOG_REFRESH_SECONDS)
+
+# --- Entitlements ---
+
+def get_entitlements(user_uuid):
+    """Return the set of metaphor ids owned by a user"""
+    owned = entitlement_cache.get(user_uuid)
+    if owned is None:
+        result = supabase.table('user_purchases')\
+            .select('metaphor_id')\
+            .eq('user_uuid', user_uuid)\
+            .execute()
+        owned = frozenset(p['metaphor_id'] for p in result.data)
+        entitlement_cache.set(user_uuid, owned)
+    return owned
+
+def catalog_with_entitlements(user_uuid):
+    """Return (catalog snapshot, owned ids); a cold catalog loads alongside the ownership query"""
+    if catalog.loaded:
+        return catalog.get(), get_entitlements(user_uuid)
+    snapshot, owned = fan_out(catalog.get, lambda: get_entitlements(user_uuid))
+    return snapshot, owned
+
+def grant_entitlements(user_uuid, metaphor_ids):
+    """Add newly purchased metaphors to the user's cached entitlement set"""
+    entitlement_cache.update(user_uuid, lambda owned: owned | frozenset(metaphor_ids))
+
+def grant_metaphors(user_uuid, metaphor_ids):
+    """Grant any metaphors the user does not own yet in one round trip.
+
+    The grant_metaphors RPC inserts with ON CONFLICT (user_uuid, metaphor_id)
+    DO NOTHING, so concurrent purchases cannot create duplicate rows.
+    Returns (granted, already_owned) in the order the ids were given.
+    """
+    metaphor_ids = list(dict.fromkeys(metaphor_ids))
+    result = supabase.rpc('grant_metaphors', {
+        'p_user_uuid': user_uuid,
+        'p_metaphor_ids': metaphor_ids
+    }).execute()
+
+    newly_granted = {row['metaphor_id'] for row in result.data if row['granted']}
+    granted = [m for m in metaphor_ids if m in newly_granted]
+    already_owned = [m for m in metaphor_ids if m not in newly_granted]
+    grant_entitlements(user_uuid, metaphor_ids)
+    return granted, already_owned
+
+def metaphor_content(metaphor, owned):
+    """Build the content payload for a metaphor - full if owned, preview if not"""
+    has_access = metaphor['id'] in owned
+    payload = {
+        'id': metaphor['id'],
+        'title': metaphor['title'],
+        'content': metaphor['full_content'] if has_access else metaphor['preview_content'],
+        'has_access': has_access,
+        'is_preview': not has_access
+    }
+    # Structured content is part of the paid content, like full_content
+    if has_access and metaphor.get('content_json'):
+        payload['content_json'] = metaphor['content_json']
+    return payload
+
+# --- Write-behind Buffer ---
+
+class WriteBuffer:
+    """Buffers form rows in memory and bulk-inserts them from a background thread.
+
+    Every row is appended to this process's spill file before the request
+    returns, and the file is rotated once its rows are flushed. Spill files
+    left by a process that died (i.e. not flock'ed by a live one) are
+    replayed when the buffer starts. Rows that still fail after max_attempts
+    are moved to a failed-<pid>.jsonl file next to the spill files. Tables
+    listed in `conflicts` are upserted on that key, ignoring duplicates, so a
+    repeat row can't fail the whole batch.
+
+    With background=False there is no flusher: append() writes the row
+    before returning and raises if the write fails. An upserted row the
+    table already had is reported as a duplicate.
+    """
+
+    def __init__(self, spill_dir, flush_rows, flush_ms, max_attempts, conflicts=None, background=True):
+        self.background = background
+        self.spill_dir = spill_dir
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_ms / 1000
+        self.max_attempts = max_attempts
+        self.conflicts = conflicts or {}
+        self.counters = {'written': 0, 'duplicates': 0, 'buffered': 0, 'flushed': 0, 'batches': 0, 'retried': 0, 'failed': 0, 'recovered': 0}
+        self._pending = {}
+        self._spill = None
+        self._started = False
+        self._backoff = 0
+        self._cond = threading.Condition()
+
+    def append(self, table, row):
+        """Store a row. Returns 'written', 'duplicate' or 'queued'.
+
+        A queued row is durable in the spill file once this returns; whether
+        it was a duplicate is not known until it is flushed.
+        """
+        if not self.background:
+            if not self._write(table, [row]):
+                self._count(duplicates=1)
+                return 'duplicate'
+            self._count(written=1)
+            return 'written'
+
+        self.start()
+        with self._cond:
+            self._add(table, row)
+            self.counters['buffered'] += 1
+            if len(self._pending[table]) >= self.flush_rows:
+                self._cond.notify()
+        return 'queued'
+
+    def _add(self, table, row, attempts=0):
+        # Caller holds self._cond
+        self._pending.setdefault(table, []).append((row, attempts))
+        if self._spill:
+            self._spill.write(json.dumps({'table': table, 'row': row, 'attempts': attempts}) + '\n')
+            self._spill.flush()
+
+    def start(self):
+        """Open the spill file, replay orphaned ones and start the flusher"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self._spill = self._open_spill()
+                self._recover()
+            except OSError as e:
+                print(f"Write buffer spill disabled: {e}")
+                self._spill = None
+
+        threading.Thread(target=self._run, name='write-buffer', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _open_spill(self):
+        import fcntl
+        spill = open(os.path.join(self.spill_dir, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl'), 'a', encoding='utf-8')
+        fcntl.flock(spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return spill
+
+    def _recover(self):
+        # Caller holds self._cond; a spill file we can lock has no live owner
+        import fcntl
+        for name in sorted(os.listdir(self.spill_dir)):
+            path = os.path.join(self.spill_dir, name)
+            if not name.endswith('.jsonl') or name.startswith('failed-') or path == self._spill.name:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # torn final line from a crash mid-write
+                        self._add(entry['table'], entry['row'], entry.get('attempts', 0))
+                        self.counters['recovered'] += 1
+                    os.remove(path)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                print(f"Could not replay spill file {name}: {e}")
+
+    def _run(self):
+        while True:
+            # After a failed flush, wait (doubling up to a minute) before retrying
+            if self._backoff:
+                time.sleep(self._backoff)
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: any(len(rows) >= self.flush_rows for rows in self._pending.values()),
+                    timeout=self.flush_seconds
+                )
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write buffer flush failed: {e}")
+
+    def flush(self):
+        """Insert everything buffered so far with one request per table"""
+        with self._cond:
+            if not any(self._pending.values()):
+                return
+            pending, self._pending = self._pending, {}
+            # Rotate: the rows taken here live only in the old file until written
+            old_spill = self._spill
+            if old_spill:
+                try:
+                    self._spill = self._open_spill()
+                except OSError as e:
+                    print(f"Could not rotate write buffer spill file: {e}")
+                    old_spill = None
+
+        failed = []
+        for table, entries in pending.items():
+            for start in range(0, len(entries), self.flush_rows):
+                failed.extend((table, row, attempts) for row, attempts in self._insert(table, entries[start:start + self.flush_rows]))
+
+        with self._cond:
+            self._backoff = min(max(self._backoff * 2, self.flush_seconds), 60) if failed else 0
+            for table, row, attempts in failed:
+                if attempts + 1 >= self.max_attempts:
+                    self._set_aside(table, row, attempts + 1)
+                else:
+                    self._add(table, row, attempts + 1)
+                    self.counters['retried'] += 1
+        if old_spill:
+            old_spill.close()
+            os.remove(old_spill.name)
+
+    def _set_aside(self, table, row, attempts):
+        # Caller holds self._cond; keep the row for a manual replay rather than losing it
+        print(f"Giving up on {table} row after {attempts} attempts: {row}")
+        self.counters['failed'] += 1
+        try:
+            with open(os.path.join(self.spill_dir, f'failed-{os.getpid()}.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'table': table, 'row': row, 'attempts': attempts}) + '\n')
+        except OSError as e:
+            print(f"Could not record failed {table} row: {e}")
+
+    def _insert(self, table, entries):
+        """Bulk-insert one batch; on failure retry row by row and return the rows that still fail"""
+        rows = [row for row, _ in entries]
+        try:
+            self._write(table, rows)
+            self._count(flushed=len(rows), batches=1)
+            return []
+        except Exception as e:
+            print(f"Bulk insert into {table} failed ({len(rows)} rows): {e}")
+
+        failed = []
+        for row, attempts in entries:
+            try:
+                self._write(table, [row])
+                self._count(flushed=1, batches=1)
+            except Exception:
+                failed.append((row, attempts))
+        return failed
+
+    def _write(self, table, rows):
+        """Insert rows; returns the ones stored (an upsert leaves out duplicates)"""
+        on_conflict = self.conflicts.get(table)
+        if on_conflict:
+            return supabase.table(table).upsert(rows, on_conflict=on_conflict, ignore_duplicates=True).execute().data
+        return supabase.table(table).insert(rows).execute().data
+
+    def _count(self, **counts):
+        with self._cond:
+            for name, n in counts.items():
+                self.counters[name] += n
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, pending=sum(len(rows) for rows in self._pending.values()))
+
+write_buffer = WriteBuffer(
+    WRITE_BUFFER_SPILL_DIR,
+    WRITE_BUFFER_FLUSH_ROWS,
+    WRITE_BUFFER_FLUSH_MS,
+    WRITE_BUFFER_MAX_ATTEMPTS,
+    conflicts={'universal_subscription': 'email'},
+    background=WRITE_BUFFER_BACKGROUND
+)
+
+# --- Subscription Index ---
+
+def normalize_email(email):
+    return email.strip().lower()
+
+class SubscriptionIndex:
+    """Hash set of subscribed emails, used to reject repeat signups locally.
+
+    Stores an 8-byte digest per normalized email (a few MB for a million
+    subscribers). The set is loaded in the background on first use and
+    reloaded every refresh_seconds, so signups from other processes show up
+    eventually; until then the upsert on email is what keeps the table
+    unique.
+
+    With preload=False the table is never scanned and only emails added in
+    this process are known, for when the upsert's answer is checked anyway.
+    """
+
+    def __init__(self, refresh_seconds, page_size, preload=True):
+        self.preload = preload
+        self.refresh_seconds = refresh_seconds
+        self.page_size = page_size
+        self.counters = {'rejected': 0, 'accepted': 0, 'loads': 0}
+        self._digests = None
+        self._added = set()
+        self._loaded_at = 0.0
+        self._loading = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(email):
+        return hashlib.blake2b(normalize_email(email).encode('utf-8'), digest_size=8).digest()
+
+    def _load(self):
+        digests = set()
+        last_id = 0
+        while True:
+            result = supabase.table('universal_subscription')\
+                .select('id, email')\
+                .gt('id', last_id)\
+                .order('id')\
+                .limit(self.page_size)\
+                .execute()
+            digests.update(self._digest(row['email']) for row in result.data if row.get('email'))
+            if len(result.data) < self.page_size:
+                break
+            last_id = result.data[-1]['id']
+
+        with self._lock:
+            # Keep emails added locally while the load was running
+            self._digests = digests | self._added
+            self._added = set()
+            self._loaded_at = time.monotonic()
+            self.counters['loads'] += 1
+
+    def _load_in_background(self):
+        try:
+            self._load()
+        except Exception as e:
+            print(f"Subscription index load failed: {e}")
+        finally:
+            self._loading = False
+
+    def _ensure_fresh(self):
+        if not self.preload:
+            return
+        if self._digests is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        with self._lock:
+            start_load = not self._loading
+            self._loading = True
+        if start_load:
+            threading.Thread(target=self._load_in_background, daemon=True).start()
+
+    def add(self, email):
+        """Record an email; False if it was already known to be subscribed"""
+        self._ensure_fresh()
+        digest = self._digest(email)
+        with self._lock:
+            known = self._digests if self._digests is not None else set()
+            if digest in known or digest in self._added:
+                self.counters['rejected'] += 1
+                return False
+            self.counters['accepted'] += 1
+            if self._digests is not None:
+                self._digests.add(digest)
+            if self._loading or self._digests is None:
+                self._added.add(digest)
+            return True
+
+    def discard(self, email):
+        """Forget an email whose subscription could not be stored"""
+        digest = self._digest(email)
+        with self._lock:
+            if self._digests is not None:
+                self._digests.discard(digest)
+            self._added.discard(digest)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, size=len(self._digests or ()), loaded=self._digests is not None)
+
+# Synchronous writes see duplicates in the upsert result, so a cold serverless
+# instance doesn't scan the whole table first
+subscription_index = SubscriptionIndex(
+    SUBSCRIPTION_INDEX_REFRESH_SECONDS,
+    SUBSCRIPTION_INDEX_PAGE_SIZE,
+    preload=WRITE_BUFFER_BACKGROUND
+)
+
 # TEMPORARY: Original homepage (uncomment after Apple approval)
 # @app.route('/')
 # def index():
-#     return send_from_directory('views', 'index.html')
+#     return send_page('index.html')
 
 # TEMPORARY: Professional page for Apple review
 @app.route('/')
 def index():
-    return send_from_directory('views', 'apple-home.html')
+    return send_page('apple-home.html')
 
 # Original creative homepage (accessible during Apple review period)
 @app.route('/product')
 def product_page():
-    return send_from_directory('views', 'index.html')
+    return send_page('index.html')
 
 @app.route('/subliminalgen')
 def subliminalgen():
-    return send_from_directory('views', 'subliminalgen.html')
+    return send_page('subliminalgen.html')
 
 @app.route('/pitch')
 def pitch():
-    return send_from_directory('views', 'pitch.html')
+    return send_page('pitch.html')
 
 @app.route('/investor')
 def investor():
-    return send_from_directory('views', 'speedrun.html')
+    return send_page('speedrun.html')
 
 @app.route('/metaphors')
 def metaphors():
-    return send_from_directory('views', 'game.html')
+    return send_page('game.html')
 
 @app.route('/manifestation-tool')
 def manifestation_tool():
-    return send_from_directory('views', 'manifestation-tool.html')
+    return send_page('manifestation-tool.html')
 
 @app.route('/interview-round-1')
 def interview_round_1():
     # Public access (no token) - redirect or show error
-    return send_from_directory('views', 'questionnaire.html')
+    return send_page('questionnaire.html')
+
+# --- Interview Invites ---
+
+def fetch_invite(token):
+    """Read an invite row by token, bypassing the cache"""
+    result = supabase.table('interview_invites')\
+        .select('*')\
+        .eq('token', token)\
+        .limit(1)\
+        .execute()
+    invite = result.data[0] if result.data else None
+    if invite:
+        invite_cache.set(token, invite)
+    return invite
+
+def get_invite(token):
+    """Return the invite for a token from the short-lived cache, or None if unknown"""
+    return invite_cache.get(token) or fetch_invite(token)
+
+def invite_expired(invite):
+    if not invite['expires_at']:
+        return False
+    expires = datetime.fromisoformat(invite['expires_at'].replace('Z', '+00:00'))
+    now = datetime.now(expires.tzinfo) if expires.tzinfo else datetime.utcnow()
+    return now > expires
+
+def start_invite(token):
+    """Mark a pending, unexpired invite as started and return it, in one conditional update.
+
+    Returns None when nothing matched (unknown, already started/completed,
+    expired, or without an expiry date) so the caller can fall back to a read.
+    """
+    now = datetime.utcnow().isoformat()
+    result = supabase.table('interview_invites')\
+        .update({'status': 'started', 'started_at': now})\
+        .eq('token', token)\
+        .eq('status', 'pending')\
+        .gt('expires_at', now)\
+        .execute()
+    invite = result.data[0] if result.data else None
+    if invite:
+        invite_cache.set(token, invite)
+    return invite
+
+def inline_json(payload_bytes):
+    """Make serialized JSON safe to embed inside a <script> element"""
+    return payload_bytes.replace(b'<', b'\\u003c').replace(b'>', b'\\u003e').replace(b'&', b'\\u0026')
 
 @app.route('/interview/<token>')
 def interview_with_token(token):
-    """Serve interview page for valid token"""
+    """Serve interview page for valid token, with invite and questions inlined"""
     try:
-        # Validate token
-        result = supabase.table('interview_invites')\
-            .select('*')\
-            .eq('token', token)\
-            .single()\
-            .execute()
+        invite = invite_cache.get(token)
+        if not invite or invite['status'] == 'pending':
+            invite = start_invite(token) or get_invite(token)
 
-        if not result.data:
+        if not invite:
             return "Invalid or expired interview link.", 404
 
-        invite = result.data
-
         # Check if already completed
         if invite['status'] == 'completed':
             return "This interview has already been submitted.", 400
 
         # Check if expired
-        if invite['expires_at']:
-            from datetime import datetime
-            expires = datetime.fromisoformat(invite['expires_at'].replace('Z', '+00:00'))
-            if datetime.now(expires.tzinfo) > expires:
-                return "This interview link has expired.", 400
+        if invite_expired(invite):
+            return "This interview link has expired.", 400
 
-        # Mark as started if first time
+        # Mark as started if first time (invites without an expiry date)
         if invite['status'] == 'pending':
             supabase.table('interview_invites')\
                 .update({'status': 'started', 'started_at': datetime.utcnow().isoformat()})\
                 .eq('token', token)\
+                .eq('status', 'pending')\
                 .execute()
-
-        # Serve dynamic questionnaire (fetches questions based on position)
-        return send_from_directory('views', 'questionnaire-dynamic.html')
+            invite_cache.pop(token)
+
+        # Serve dynamic questionnaire with the data it would otherwise fetch
+        page = pages.get('questionnaire-dynamic.html')
+        if page is None:
+            abort(404)
+        questions = interview_questions.get(invite['position'] or 'Design Intern')
+        inlined = b''.join([
+            b'<script>window.__INTERVIEW__ = {"invite":',
+            inline_json(app.json.dumps({
+                'valid': True,
+                'candidate_email': invite['candidate_email'],
+                'candidate_name': invite['candidate_name'],
+                'position': invite['position']
+            }).encode('utf-8')),
+            b',"questions":',
+            inline_json(questions[0]) if questions else b'null',
+            b'};</script></head>'
+        ])
+        response = Response(page.variants[None][0].replace(b'</head>', inlined, 1), mimetype='text/html')
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
 
     except Exception as e:
         print(f"Interview token error: {e}")
@@ -197,17 +2008,11 @@ def interview_with_token(token):
 def validate_interview_token(token):
     """Validate token and return candidate info"""
     try:
-        result = supabase.table('interview_invites')\
-            .select('*')\
-            .eq('token', token)\
-            .single()\
-            .execute()
+        invite = get_invite(token)
 
-        if not result.data:
+        if not invite:
             return jsonify({'valid': False, 'error': 'Invalid token'}), 404
 
-        invite = result.data
-
         if invite['status'] == 'completed':
             return jsonify({'valid': False, 'error': 'Already submitted'}), 400
 
@@ -221,70 +2026,64 @@ def validate_interview_token(token):
     except Exception as e:
         return jsonify({'valid': False, 'error': str(e)}), 500
 
-@app.route('/api/interview/questions/<position>', methods=['GET'])
+@app.route('/api/interview/questions/<path:position>', methods=['GET'])
 def get_interview_questions(position):
     """Get interview questions for a specific position"""
     # URL decode the position
     from urllib.parse import unquote
     position = unquote(position)
 
-    if position in INTERVIEW_QUESTIONS:
-        return jsonify(INTERVIEW_QUESTIONS[position]), 200
+    encoded = interview_questions.get(position)
+    if encoded:
+        return cached_json_response(*encoded)
     else:
         # Return available positions if not found
-        return jsonify({
-            'error': 'Position not found',
-            'available_positions': list(INTERVIEW_QUESTIONS.keys())
-        }), 404
+        return Response(interview_questions.not_found_body(), status=404, mimetype='application/json')
 
 @app.route('/api/interview/submit', methods=['POST'])
 def submit_interview():
-    """Submit interview responses"""
+    """Submit interview responses exactly once.
+
+    The submit_interview RPC completes the invite and stores the responses in
+    one transaction. A retry carrying the same Idempotency-Key (header or
+    'idempotency_key' field) gets the original success instead of an error.
+    """
     data = request.get_json()
     token = data.get('token')
     responses = data.get('responses')
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
 
     if not token or not responses:
         return jsonify({'error': 'Token and responses required'}), 400
 
+    success = {'success': True, 'message': 'Interview submitted successfully'}
+    if idempotency_key and submission_cache.get((token, idempotency_key)):
+        return jsonify(success), 200
+
     try:
-        # Validate token
-        invite_result = supabase.table('interview_invites')\
-            .select('*')\
-            .eq('token', token)\
-            .single()\
-            .execute()
+        result = supabase.rpc('submit_interview', {
+            'p_token': token,
+            'p_responses': responses,
+            'p_idempotency_key': idempotency_key
+        }).execute()
+        outcome = result.data
 
-        if not invite_result.data:
+        if outcome == 'invalid':
             return jsonify({'error': 'Invalid token'}), 404
-
-        invite = invite_result.data
-
-        if invite['status'] == 'completed':
+        if outcome == 'already_submitted':
             return jsonify({'error': 'Already submitted'}), 400
 
-        # Save responses
-        supabase.table('interview_responses').insert({
-            'invite_id': invite['id'],
-            'token': token,
-            'candidate_email': invite['candidate_email'],
-            'candidate_name': invite['candidate_name'],
-            'responses': responses
-        }).execute()
-
-        # Mark invite as completed
-        supabase.table('interview_invites')\
-            .update({'status': 'completed', 'completed_at': datetime.utcnow().isoformat()})\
-            .eq('token', token)\
-            .execute()
-
-        return jsonify({'success': True, 'message': 'Interview submitted successfully'}), 200
+        invite_cache.pop(token)
+        if idempotency_key:
+            submission_cache.set((token, idempotency_key), True)
+        return jsonify(success), 200
 
     except Exception as e:
         print(f"Interview submit error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/interview/create', methods=['POST'])
+@rate_limited('interview_create')
 def create_interview_invite():
     """Create a new interview invite (admin use)"""
     data = request.get_json()
@@ -325,47 +2124,121 @@ def create_interview_invite():
 
 @app.route('/home')
 def home():
-    return send_from_directory('views', 'apple-home.html')
+    return send_page('apple-home.html')
 
 @app.route('/privacy')
 def privacy():
-    return send_from_directory('views', 'privacy.html')
+    return send_page('privacy.html')
 
 @app.route('/app-privacy')
 def app_privacy():
-    return send_from_directory('views', 'app-privacy.html')
+    return send_page('app-privacy.html')
 
 @app.route('/terms')
 def terms():
-    return send_from_directory('views', 'terms.html')
+    return send_page('terms.html')
 
 @app.route('/app-terms')
 def app_terms():
-    return send_from_directory('views', 'app-terms.html')
+    return send_page('app-terms.html')
 
 @app.route('/support')
 def support():
-    return send_from_directory('views', 'support.html')
+    return send_page('support.html')
 
 @app.route('/confirmed')
 def email_confirmed():
-    return send_from_directory('views', 'confirmed.html')
+    return send_page('confirmed.html')
+
+def render_metaphor_page(page, metaphor, content):
+    """Return metaphor-detail.html filled with a metaphor's header and content, both also inlined for the page script"""
+    data = {f: metaphor.get(f) for f in METAPHOR_CARD_FIELDS}
+
+    def text(value):
+        return html.escape(str(value or ''), quote=True)
+
+    keywords = ' · '.join(metaphor.get('keywords') or [])
+    summary = metaphor.get('doctrine') or (metaphor.get('preview_content') or '')[:160]
+    paragraphs = ''.join(
+        f'<p>{text(block)}</p>' for block in re.split(r'\n\s*\n', content['content'] or '') if block.strip()
+    )
+    replacements = [
+        ('<title>Metaphor Detail - Psyche</title>',
+         f'<title>{text(metaphor.get("title"))} - Psyche</title>\n'
+         f'  <meta name="description" content="{text(summary)}">\n'
+         f'  <link rel="canonical" href="/metaphors/{text(quote(str(metaphor["id"])))}">'),
+        ('<div id="loading" class="loading">', '<div id="loading" class="loading" style="display: none;">'),
+        ('<div id="content" style="display: none;">', '<div id="content">'),
+        ('id="symbol">✦</div>', f'id="symbol">{text(metaphor.get("symbol") or "✦")}</div>'),
+        ('id="title">Loading...</h1>', f'id="title">{text(metaphor.get("title"))}</h1>'),
+        ('id="keywords"></div>', f'id="keywords">{text(keywords)}</div>'),
+        ('id="doctrine"></div>', f'id="doctrine">{text(metaphor.get("doctrine"))}</div>'),
+        ('<!-- Content will be loaded here -->', paragraphs),
+    ]
+    body = page.variants[None][0].decode('utf-8')
+    for old, new in replacements:
+        body = body.replace(old, new, 1)
+
+    inlined = b''.join([
+        b'<script>window.__METAPHOR__ = {"metaphor":',
+        inline_json(app.json.dumps(data).encode('utf-8')),
+        b',"content":',
+        inline_json(app.json.dumps(content).encode('utf-8')),
+        b'};</script></head>'
+    ])
+    return body.encode('utf-8').replace(b'</head>', inlined, 1)
 
 @app.route('/metaphors/<metaphor_id>')
 def metaphor_detail(metaphor_id):
-    return send_from_directory('views', 'metaphor-detail.html')
+    """Serve the metaphor page rendered from the catalog: previews for everyone, full content for owners"""
+    page = pages.get('metaphor-detail.html')
+    if page is None:
+        abort(404)
+
+    try:
+        user_id = get_optional_user_id()
+        if user_id is None:
+            snapshot, owned = catalog.get(), frozenset()
+        else:
+            snapshot, owned = catalog_with_entitlements(user_id)
+    except Exception as e:
+        # The static page still loads the metaphor itself
+        print(f"Metaphor page render failed: {e}")
+        return send_html(page.variants)
+
+    metaphor = snapshot.metaphors_by_id.get(metaphor_id)
+    if not metaphor:
+        return Response(page.variants[None][0], status=404, mimetype='text/html')
+
+    content = metaphor_content(metaphor, owned)
+    if user_id is not None:
+        # Personalised and uncached, so not worth compressing per request
+        body = render_metaphor_page(page, metaphor, content)
+        return send_html({None: (body, hashlib.sha256(body).hexdigest()[:32])}, cache_control='private, no-store')
+
+    # Keyed on the template's ETag too, so an edited page is picked up under PAGE_CACHE_RELOAD
+    variants = snapshot.rendered(
+        ('metaphor-page', metaphor_id, page.variants[None][1]),
+        lambda: compressed_variants(render_metaphor_page(page, metaphor, content))
+    )
+    response = send_html(
+        variants,
+        cache_control=f'public, max-age={CATALOG_MAX_AGE_SECONDS}, stale-while-revalidate={CATALOG_MAX_AGE_SECONDS * 5}'
+    )
+    response.vary.add('Authorization')
+    return response
 
 @app.route('/views/<path:filename>')
 def views_static(filename):
-    return send_from_directory('views', filename)
+    return send_asset('views', filename)
 
 @app.route('/logos/<path:filename>')
 def logos_static(filename):
-    return send_from_directory('logos', filename)
+    return send_asset('logos', filename)
 
 @app.route('/images/<path:filename>')
 def images_static(filename):
-    return send_from_directory('images', filename)
+    return send_asset('images', filename)
 
 @app.route('/<path:path>')
 def static_files(path):
@@ -375,9 +2248,41 @@ def static_files(path):
 def health():
     return jsonify({'status': 'healthy'}), 200
 
+def require_metrics_token(f):
+    """Decorator for the diagnostics endpoints; closed unless METRICS_TOKEN is set"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not METRICS_TOKEN:
+            return jsonify({'error': 'Metrics are disabled'}), 404
+        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        if not hmac.compare_digest(token, METRICS_TOKEN):
+            return jsonify({'error': 'Invalid metrics token'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.route('/health/details', methods=['GET'])
+@require_metrics_token
+def health_details():
+    """Queue, cache, rate limiter and database stats"""
+    return jsonify({
+        'status': 'healthy',
+        'webhook_queue': webhook_queue.stats(),
+        'write_buffer': write_buffer.stats(),
+        'subscription_index': subscription_index.stats(),
+        'rate_limits': rate_limiter.stats(),
+        'db': db_metrics.summary()
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+@require_metrics_token
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 # --- Auth Endpoints ---
 
 @app.route('/api/auth/google', methods=['POST'])
+@rate_limited('auth_google')
 def auth_google():
     """Handle Google Sign-In - uses users table for user storage"""
     data = request.get_json()
@@ -389,35 +2294,12 @@ def auth_google():
     google_user = verify_google_token(id_token_str)
     if not google_user:
         return jsonify({'error': 'Invalid Google token'}), 401
+    if not isinstance(google_user['email'], str) or not google_user['email']:
+        return jsonify({'error': 'Google account has no email address'}), 400
 
     try:
-        # Check if user exists by google_id in users table
-        existing = supabase.table('users')\
-            .select('*')\
-            .eq('google_id', google_user['google_id'])\
-            .limit(1)\
-            .execute()
-
-        if existing.data and len(existing.data) > 0:
-            user = existing.data[0]
-            user_id = user['id']
-            # Update existing user info
-            supabase.table('users').update({
-                'name': google_user['name']
-            }).eq('google_id', google_user['google_id']).execute()
-        else:
-            # Create new user entry
-            result = supabase.table('users').insert({
-                'email': google_user['email'],
-                'name': google_user['name'],
-                'provider': 'google',
-                'google_id': google_user['google_id']
-            }).execute()
-            user = result.data[0]
-            user_id = user['id']
-
-        # Create session using user uuid as identifier
-        session_token, expires_at = create_session(user['uuid'], google_user['google_id'])
+        # Create or update the user and its session (keyed by user uuid) together
+        user, session_token, expires_at = login_google_user(google_user)
 
         return jsonify({
             'user': {
@@ -466,105 +2348,210 @@ def get_current_user():
 def logout():
     """Invalidate current session"""
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    session_cache.pop(token)
     try:
+        claims = signed_session_claims(token)
+        if claims:
+            revoked_sessions.revoke(claims)
+            return jsonify({'message': 'Logged out successfully'}), 200
+
         supabase.table('sessions').delete().eq('token', token).execute()
         return jsonify({'message': 'Logged out successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/subscribe', methods=['POST'])
+@rate_limited('subscribe')
 def subscribe():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     email = data.get('email')
-    
-    if not email:
+    if not isinstance(email, str) or not email.strip():
         return jsonify({'error': 'Email is required'}), 400
-    
+    email = normalize_email(email)
+
+    if not subscription_index.add(email):
+        return jsonify({'error': 'Email already subscribed'}), 400
+
     try:
-        result = supabase.table('universal_subscription').insert({
-            'email': email
-        }).execute()
-        
-        return jsonify({'message': 'Successfully subscribed!'}), 200
+        stored = write_buffer.append('universal_subscription', {'email': email})
     except Exception as e:
-        if 'duplicate' in str(e).lower():
-            return jsonify({'error': 'Email already subscribed'}), 400
+        subscription_index.discard(email)
         return jsonify({'error': str(e)}), 500
 
+    if stored == 'duplicate':
+        subscription_index.discard(email)
+        return jsonify({'error': 'Email already subscribed'}), 400
+    return jsonify({'message': 'Successfully subscribed!'}), 202 if stored == 'queued' else 200
+
 # Metaphor API Endpoints
 
+def parse_metaphor_fields(value):
+    """Validate a comma-separated fields= list; id is always included"""
+    if not value:
+        return METAPHOR_CARD_FIELDS
+    requested = {f.strip() for f in value.split(',') if f.strip()}
+    unknown = requested - set(METAPHOR_LIST_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. "
+                         f"Allowed: {', '.join(METAPHOR_LIST_FIELDS)}")
+    requested.add('id')
+    return tuple(f for f in METAPHOR_LIST_FIELDS if f in requested)
+
+def parse_page_limit(value):
+    """None when absent; otherwise a positive integer, capped at METAPHOR_PAGE_MAX"""
+    if value is None:
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    return min(limit, METAPHOR_PAGE_MAX)
+
+def encode_metaphor_cursor(metaphor):
+    return _b64encode(json.dumps(metaphor_sort_key(metaphor), separators=(',', ':')).encode('utf-8'))
+
+def decode_metaphor_cursor(cursor):
+    try:
+        unset, order_index, metaphor_id = json.loads(_b64decode(cursor))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(order_index, (int, float)) or isinstance(order_index, bool):
+        raise ValueError('Invalid cursor')
+    return (bool(unset), order_index, str(metaphor_id))
+
+def project_metaphors(metaphors, fields):
+    return [{f: m.get(f) for f in fields} for m in metaphors]
+
 @app.route('/api/metaphors', methods=['GET'])
 def get_metaphors():
-    """Get all metaphors from database"""
+    """List catalog metaphors as cards, with optional fields= and keyset pagination"""
     try:
-        result = supabase.table('metaphors')\
-            .select('*')\
-            .order('order_index')\
-            .execute()
-        return jsonify(result.data), 200
+        fields = parse_metaphor_fields(request.args.get('fields'))
+        limit = parse_page_limit(request.args.get('limit'))
+        after = request.args.get('after')
+        start_key = decode_metaphor_cursor(after) if after else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        snapshot = catalog.get()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    if limit is None and start_key is None:
+        body, etag = snapshot.encoded(('metaphors', fields), lambda: project_metaphors(snapshot.metaphors, fields))
+        return cached_json_response(body, etag)
+
+    start = bisect.bisect_right(snapshot.metaphor_keys, start_key) if start_key else 0
+    end = len(snapshot.metaphors) if limit is None else start + limit
+    page = snapshot.metaphors[start:end]
+    body = app.json.dumps(project_metaphors(page, fields)).encode('utf-8')
+    response = cached_json_response(body, hashlib.sha256(body).hexdigest()[:32])
+    if end < len(snapshot.metaphors):
+        query = {'limit': limit, 'after': encode_metaphor_cursor(page[-1])}
+        if 'fields' in request.args:
+            query['fields'] = ','.join(fields)
+        response.headers['Link'] = f'<{request.path}?{urlencode(query)}>; rel="next"'
+    return response
+
 @app.route('/api/metaphors/<metaphor_id>', methods=['GET'])
 def get_metaphor(metaphor_id):
-    """Get single metaphor by ID from database"""
+    """Get single metaphor by ID from the catalog: card fields and preview_content only"""
     try:
-        result = supabase.table('metaphors')\
-            .select('*')\
-            .eq('id', metaphor_id)\
-            .single()\
-            .execute()
-        return jsonify(result.data), 200
+        snapshot = catalog.get()
     except Exception as e:
-        return jsonify({'error': str(e)}), 404
+        return jsonify({'error': str(e)}), 500
+
+    metaphor = snapshot.metaphors_by_id.get(metaphor_id)
+    if not metaphor:
+        return jsonify({'error': 'Metaphor not found'}), 404
+
+    body, etag = snapshot.encoded(
+        ('metaphor', metaphor_id),
+        lambda: project_metaphors([metaphor], METAPHOR_LIST_FIELDS)[0]
+    )
+    return cached_json_response(body, etag)
 
 @app.route('/api/user/purchases', methods=['GET'])
 @require_auth
 def get_user_purchases():
     """Get all metaphors purchased by current user"""
     try:
-        result = supabase.table('user_purchases')\
-            .select('metaphor_id')\
-            .eq('user_uuid', request.user_id)\
-            .execute()
+        return jsonify(sorted(get_entitlements(request.user_id))), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/metaphors/content', methods=['GET'])
+@require_auth
+def get_metaphor_contents():
+    """Get content for several metaphors at once (?ids=poker,chess)"""
+    ids = [i for i in request.args.get('ids', '').split(',') if i]
+    if not ids:
+        return jsonify({'error': 'ids parameter required'}), 400
+    if len(ids) > LIBRARY_MAX_BATCH_IDS:
+        return jsonify({'error': f'At most {LIBRARY_MAX_BATCH_IDS} ids per request'}), 400
 
-        purchased_ids = [p['metaphor_id'] for p in result.data]
-        return jsonify(purchased_ids), 200
+    try:
+        snapshot, owned = catalog_with_entitlements(request.user_id)
+        metaphors_by_id = snapshot.metaphors_by_id
+
+        return jsonify({
+            'metaphors': [metaphor_content(metaphors_by_id[i], owned) for i in ids if i in metaphors_by_id],
+            'not_found': [i for i in ids if i not in metaphors_by_id]
+        }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/metaphors/<metaphor_id>/content', methods=['GET'])
 @require_auth
 def get_metaphor_content(metaphor_id):
-    """Get metaphor content from database - full if purchased, preview if not"""
+    """Get metaphor content - full if purchased, preview if not"""
     try:
-        # Check if user has purchased this metaphor
-        purchase_check = supabase.table('user_purchases')\
-            .select('*')\
-            .eq('user_uuid', request.user_id)\
-            .eq('metaphor_id', metaphor_id)\
-            .execute()
+        snapshot, owned = catalog_with_entitlements(request.user_id)
+        metaphor = snapshot.metaphors_by_id.get(metaphor_id)
 
-        has_purchased = len(purchase_check.data) > 0
+        if not metaphor:
+            return jsonify({'error': 'Metaphor not found'}), 404
 
-        # Get metaphor data from database
-        metaphor = supabase.table('metaphors')\
-            .select('*')\
-            .eq('id', metaphor_id)\
-            .single()\
-            .execute()
+        return jsonify(metaphor_content(metaphor, owned)), 200
 
-        if not metaphor.data:
-            return jsonify({'error': 'Metaphor not found'}), 404
-        
-        return jsonify({
-            'id': metaphor_id,
-            'title': metaphor.data['title'],
-            'content': metaphor.data['full_content'] if has_purchased else metaphor.data['preview_content'],
-            'has_access': has_purchased,
-            'is_preview': not has_purchased
-        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/library', methods=['GET'])
+def get_library():
+    """Get catalog, bundles, ownership and per-metaphor content in one response"""
+    try:
+        user_id = get_optional_user_id()
+        if user_id is None:
+            snapshot = catalog.get()
+        else:
+            snapshot, owned = catalog_with_entitlements(user_id)
+
+        def build_library(owned):
+            metaphors = []
+            for m in snapshot.metaphors:
+                entry = {f: m.get(f) for f in METAPHOR_CARD_FIELDS}
+                entry.update(metaphor_content(m, owned))
+                metaphors.append(entry)
+            return {
+                'metaphors': metaphors,
+                'bundles': snapshot.active_bundles,
+                'purchases': sorted(owned),
+                'authenticated': user_id is not None
+            }
+
+        if user_id is None:
+            body, etag = snapshot.encoded('library', lambda: build_library(frozenset()))
+            response = cached_json_response(body, etag)
+            response.vary.add('Authorization')
+            return response
+
+        response = jsonify(build_library(owned))
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response, 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -574,30 +2561,12 @@ def purchase_metaphor(metaphor_id):
     """Purchase a metaphor for the current user"""
     try:
         # Check if already purchased
-        existing = supabase.table('user_purchases')\
-            .select('*')\
-            .eq('user_uuid', request.user_id)\
-            .eq('metaphor_id', metaphor_id)\
-            .execute()
-
-        if existing.data and len(existing.data) > 0:
+        if metaphor_id in get_entitlements(request.user_id):
             return jsonify({'error': 'Already purchased'}), 400
 
-        # Get user info for the purchase record
-        user = supabase.table('users')\
-            .select('email, name')\
-            .eq('uuid', request.user_id)\
-            .single()\
-            .execute()
-
-        # Insert purchase record
-        supabase.table('user_purchases').insert({
-            'user_uuid': request.user_id,
-            'email': user.data['email'],
-            'name': user.data['name'],
-            'metaphor_id': metaphor_id,
-            'price_paid': '5.00'
-        }).execute()
+        granted, _ = grant_metaphors(request.user_id, [metaphor_id])
+        if not granted:
+            return jsonify({'error': 'Already purchased'}), 400
 
         return jsonify({'message': 'Purchase successful'}), 200
     except Exception as e:
@@ -608,13 +2577,7 @@ def purchase_metaphor(metaphor_id):
 def check_purchase(metaphor_id):
     """Check if user has purchased specific metaphor"""
     try:
-        result = supabase.table('user_purchases')\
-            .select('*')\
-            .eq('user_uuid', request.user_id)\
-            .eq('metaphor_id', metaphor_id)\
-            .execute()
-
-        return jsonify({'purchased': len(result.data) > 0}), 200
+        return jsonify({'purchased': metaphor_id in get_entitlements(request.user_id)}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -624,52 +2587,19 @@ def purchase_bundle(bundle_id):
     """Purchase a bundle - grants access to all metaphors in bundle"""
     try:
         # Get bundle info
-        bundle = supabase.table('bundles')\
-            .select('*')\
-            .eq('id', bundle_id)\
-            .single()\
-            .execute()
+        bundle = catalog.get().bundles_by_id.get(bundle_id)
 
-        if not bundle.data:
+        if not bundle:
             return jsonify({'error': 'Bundle not found'}), 404
 
-        # Get user info
-        user = supabase.table('users')\
-            .select('email, name')\
-            .eq('uuid', request.user_id)\
-            .single()\
-            .execute()
-
-        # Check what user already owns
-        existing = supabase.table('user_purchases')\
-            .select('metaphor_id')\
-            .eq('user_uuid', request.user_id)\
-            .in_('metaphor_id', bundle.data['metaphor_ids'])\
-            .execute()
-
-        already_owned = [p['metaphor_id'] for p in existing.data]
-        new_metaphors = [m for m in bundle.data['metaphor_ids'] if m not in already_owned]
-
-        # Insert new purchases
-        if new_metaphors:
-            purchases = []
-            for metaphor_id in new_metaphors:
-                purchases.append({
-                    'user_uuid': request.user_id,
-                    'email': user.data['email'],
-                    'name': user.data['name'],
-                    'metaphor_id': metaphor_id,
-                    'price_paid': '5.00'
-                })
-
-            supabase.table('user_purchases').insert(purchases).execute()
+        new_metaphors, already_owned = grant_metaphors(request.user_id, bundle['metaphor_ids'])
 
         return jsonify({
             'bundle_id': bundle_id,
-            'bundle_name': bundle.data['name'],
+            'bundle_name': bundle['name'],
             'granted_metaphors': new_metaphors,
             'already_owned': already_owned,
-            'total_metaphors': len(bundle.data['metaphor_ids']),
+            'total_metaphors': len(bundle['metaphor_ids']),
             'new_access_count': len(new_metaphors)
         }), 200
 
@@ -677,6 +2607,7 @@ def purchase_bundle(bundle_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/metaphor-suggestions', methods=['POST'])
+@rate_limited('suggestion')
 def submit_suggestion():
     """Submit a metaphor suggestion"""
     data = request.get_json()
@@ -685,18 +2616,19 @@ def submit_suggestion():
         return jsonify({'error': 'Suggestion is required'}), 400
     
     try:
-        result = supabase.table('metaphor_suggestions').insert({
+        stored = write_buffer.append('metaphor_suggestions', {
             'name': data.get('name'),
             'email': data.get('email'),
             'suggestion': data.get('suggestion'),
             'reason': data.get('reason')
-        }).execute()
-        
-        return jsonify({'message': 'Thank you for your suggestion!'}), 200
+        })
+
+        return jsonify({'message': 'Thank you for your suggestion!'}), 202 if stored == 'queued' else 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/feedback', methods=['POST'])
+@rate_limited('feedback', key_by='user')
 def submit_feedback():
     """Submit user feedback"""
     data = request.get_json()
@@ -709,19 +2641,18 @@ def submit_feedback():
         return jsonify({'error': 'Email and feedback are required'}), 400
 
     # Check if user is authenticated
-    token = request.headers.get('Authorization', '').replace('Bearer ', '')
-    user_id = verify_session(token) if token else None
+    user_id = get_optional_user_id()
 
     try:
-        supabase.table('feedback').insert({
+        stored = write_buffer.append('feedback', {
             'email': email,
             'title': title,
             'feedback': feedback,
             'source': source,
             'user_id': user_id
-        }).execute()
+        })
 
-        return jsonify({'message': 'Thank you for your feedback!'}), 200
+        return jsonify({'message': 'Thank you for your feedback!'}), 202 if stored == 'queued' else 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -731,11 +2662,9 @@ def submit_feedback():
 def get_bundles():
     """Get all available bundles"""
     try:
-        result = supabase.table('bundles')\
-            .select('*')\
-            .eq('status', 'active')\
-            .execute()
-        return jsonify(result.data), 200
+        snapshot = catalog.get()
+        body, etag = snapshot.encoded('bundles', lambda: snapshot.active_bundles)
+        return cached_json_response(body, etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -743,20 +2672,309 @@ def get_bundles():
 def get_bundle(bundle_id):
     """Get single bundle by ID"""
     try:
-        result = supabase.table('bundles')\
-            .select('*')\
-            .eq('id', bundle_id)\
-            .single()\
-            .execute()
-        return jsonify(result.data), 200
+        snapshot = catalog.get()
     except Exception as e:
-        return jsonify({'error': str(e)}), 404
+        return jsonify({'error': str(e)}), 500
+
+    bundle = snapshot.bundles_by_id.get(bundle_id)
+    if not bundle:
+        return jsonify({'error': 'Bundle not found'}), 404
+
+    body, etag = snapshot.encoded(('bundle', bundle_id), lambda: bundle)
+    return cached_json_response(body, etag)
 
 # --- Stripe Webhook ---
 
+def get_stripe():
+    """Import and configure the Stripe SDK on first use"""
+    import stripe
+    stripe.api_key = STRIPE_SECRET_KEY
+    return stripe
+
+class WebhookQueue:
+    """Durable Stripe event queue drained by a background worker pool.
+
+    Events are recorded in the stripe_events table (keyed by Stripe event id)
+    before the webhook returns, already claimed by this process: status
+    'processing' with a claimed_at time. Worker threads fulfil them in
+    batches, renewing the claim on each retry. A recovery thread claims
+    events nobody holds, i.e. 'pending' ones and those whose claim is older
+    than claim_seconds, every recover_seconds. Claims are conditional
+    updates, so an event is only ever held by one process.
+
+    With background=False there are no workers: enqueue() fulfils the event
+    itself and raises if that fails, releasing it as 'pending' so a
+    redelivery (or drain_pending(), the drain-webhooks command) can claim it.
+    """
+
+    def __init__(self, workers, batch_size, max_attempts, retry_base_seconds, claim_seconds, recover_seconds,
+                 background=True):
+        self.background = background
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.claim_seconds = claim_seconds
+        self.recover_seconds = recover_seconds
+        self.counters = {
+            'enqueued': 0,
+            'duplicates': 0,
+            'recovered': 0,
+            'processed': 0,
+            'skipped': 0,
+            'retried': 0,
+            'failed': 0
+        }
+        self._queue = queue.Queue()
+        self._retrying = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def enqueue(self, event):
+        """Record an event durably and fulfil it (or hand it to the workers); False if already seen"""
+        session = event['data']['object']
+        row = {
+            'event_id': event['id'],
+            'type': event['type'],
+            'client_reference_id': session.get('client_reference_id'),
+            'customer_email': (session.get('customer_details') or {}).get('email'),
+            'status': 'processing',
+            'attempts': 0,
+            'claimed_at': datetime.utcnow().isoformat()
+        }
+        result = supabase.table('stripe_events')\
+            .upsert(row, on_conflict='event_id', ignore_duplicates=True)\
+            .execute()
+
+        if not result.data:
+            # A redelivery: fulfil it inline only if it was left unfulfilled and nobody holds it
+            claimed = [] if self.background else self._claim(event['id'])
+            if not claimed:
+                self._count('duplicates')
+                return False
+            row = claimed[0]
+
+        self._count('enqueued')
+        if not self.background:
+            try:
+                self._fulfill([row])
+            except Exception as e:
+                self._record_failure([row], str(e), release=True)
+                raise
+            return True
+
+        self._queue.put(row)
+        self.start()
+        return True
+
+    def _claim(self, event_id=None):
+        """Take over events nobody holds (all of them, or just event_id); returns their rows"""
+        now = datetime.utcnow()
+        lapsed = (now - timedelta(seconds=self.claim_seconds)).isoformat()
+        claimed = []
+        for status in ('pending', 'processing'):
+            query = supabase.table('stripe_events')\
+                .update({'status': 'processing', 'claimed_at': now.isoformat()})\
+                .eq('status', status)
+            if status == 'processing':
+                query = query.lt('claimed_at', lapsed)
+            if event_id is not None:
+                query = query.eq('event_id', event_id)
+            claimed.extend(query.execute().data)
+        return claimed
+
+    def drain_pending(self):
+        """Claim and fulfil every event nobody holds, on the calling thread; returns how many were claimed"""
+        rows = self._claim()
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            try:
+                self._fulfill(batch)
+            except Exception as e:
+                print(f"Webhook batch failed: {e}")
+                self._record_failure(batch, str(e), release=True)
+        return len(rows)
+
+    def start(self):
+        """Start the worker pool and the recovery sweep"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'stripe-webhook-{i}', daemon=True).start()
+        threading.Thread(target=self._recover, name='stripe-webhook-recovery', daemon=True).start()
+
+    def _recover(self):
+        while True:
+            try:
+                rows = self._claim()
+                self._count('recovered', len(rows))
+                for row in rows:
+                    self._queue.put(row)
+            except Exception as e:
+                print(f"Webhook queue recovery failed: {e}")
+            time.sleep(self.recover_seconds)
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._fulfill(batch)
+            except Exception as e:
+                print(f"Webhook batch failed: {e}")
+                self._retry(batch, str(e))
+
+    def _fulfill(self, batch):
+        """Grant purchases for a batch of checkout events with one lookup per table"""
+        # Drop events repeated within the batch
+        batch = list({row['event_id']: row for row in batch}.values())
+
+        wanted = {}
+        skipped = []
+        for row in batch:
+            client_reference_id = row.get('client_reference_id') or ''
+            if '_' not in client_reference_id:
+                skipped.append(row['event_id'])
+                continue
+            wanted[row['event_id']] = tuple(client_reference_id.split('_', 1))
+
+        users = {}
+        owned = set()
+        if wanted:
+            user_uuids = list({user_uuid for user_uuid, _ in wanted.values()})
+            metaphor_ids = list({metaphor_id for _, metaphor_id in wanted.values()})
+
+            user_result, existing = fan_out(
+                lambda: supabase.table('users')
+                    .select('uuid, email, name')
+                    .in_('uuid', user_uuids)
+                    .execute(),
+                lambda: supabase.table('user_purchases')
+                    .select('user_uuid, metaphor_id')
+                    .in_('user_uuid', user_uuids)
+                    .in_('metaphor_id', metaphor_ids)
+                    .execute()
+            )
+            users = {u['uuid']: u for u in user_result.data}
+            owned = {(p['user_uuid'], p['metaphor_id']) for p in existing.data}
+
+        purchases = {}
+        processed = []
+        for event_id, (user_uuid, metaphor_id) in wanted.items():
+            user = users.get(user_uuid)
+            if not user:
+                print(f"User not found: {user_uuid}")
+                skipped.append(event_id)
+                continue
+            processed.append(event_id)
+            if (user_uuid, metaphor_id) in owned:
+                print(f"Already purchased: user={user['email']}, metaphor={metaphor_id}")
+                continue
+            purchases[(user_uuid, metaphor_id)] = {
+                'user_uuid': user_uuid,
+                'metaphor_id': metaphor_id,
+                'email': user['email'],
+                'name': user['name'],
+                'price_paid': '5.00'
+            }
+
+        if purchases:
+            supabase.table('user_purchases')\
+                .upsert(list(purchases.values()), on_conflict='user_uuid,metaphor_id', ignore_duplicates=True)\
+                .execute()
+            for user_uuid, metaphor_id in purchases:
+                grant_entitlements(user_uuid, [metaphor_id])
+                print(f"Purchase recorded: user={users[user_uuid]['email']}, metaphor={metaphor_id}")
+
+        now = datetime.utcnow().isoformat()
+        if processed:
+            supabase.table('stripe_events')\
+                .update({'status': 'processed', 'processed_at': now})\
+                .in_('event_id', processed)\
+                .execute()
+        if skipped:
+            supabase.table('stripe_events')\
+                .update({'status': 'skipped', 'processed_at': now})\
+                .in_('event_id', skipped)\
+                .execute()
+
+        self._count('processed', len(processed))
+        self._count('skipped', len(skipped))
+
+    def _retry(self, batch, error):
+        """Requeue failed events with exponential backoff, giving up after max_attempts"""
+        for row in self._record_failure(batch, error):
+            self._count('retried')
+            delay = min(self.retry_base_seconds * 2 ** (row['attempts'] - 1), 300)
+            with self._lock:
+                self._retrying += 1
+            threading.Timer(delay, self._requeue, args=(row,)).start()
+
+    def _record_failure(self, batch, error, release=False):
+        """Count a failed attempt on each event; returns the ones still worth retrying.
+
+        Events to retry stay claimed by this process, or go back to 'pending' with release=True.
+        """
+        retry = []
+        for row in batch:
+            row['attempts'] = row.get('attempts', 0) + 1
+            if row['attempts'] >= self.max_attempts:
+                status = 'failed'
+            else:
+                status = 'pending' if release else 'processing'
+            try:
+                supabase.table('stripe_events')\
+                    .update({
+                        'status': status,
+                        'attempts': row['attempts'],
+                        'last_error': error[:500],
+                        'claimed_at': datetime.utcnow().isoformat()
+                    })\
+                    .eq('event_id', row['event_id'])\
+                    .execute()
+            except Exception as e:
+                print(f"Could not record webhook failure for {row['event_id']}: {e}")
+
+            if status == 'failed':
+                self._count('failed')
+            else:
+                retry.append(row)
+        return retry
+
+    def _requeue(self, row):
+        with self._lock:
+            self._retrying -= 1
+        self._queue.put(row)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, depth=self._queue.qsize(), retrying=self._retrying)
+
+webhook_queue = WebhookQueue(
+    STRIPE_WEBHOOK_WORKERS,
+    STRIPE_WEBHOOK_BATCH_SIZE,
+    STRIPE_WEBHOOK_MAX_ATTEMPTS,
+    STRIPE_WEBHOOK_RETRY_BASE_SECONDS,
+    STRIPE_WEBHOOK_CLAIM_SECONDS,
+    STRIPE_WEBHOOK_RECOVER_SECONDS,
+    background=STRIPE_WEBHOOK_BACKGROUND
+)
+
 @app.route('/api/stripe/webhook', methods=['POST'])
 def stripe_webhook():
-    """Handle Stripe webhook events"""
+    """Verify a Stripe webhook, record it and fulfil it (inline, or on the queue's workers)"""
     payload = request.get_data()
     sig_header = request.headers.get('Stripe-Signature')
 
@@ -768,6 +2986,7 @@ def stripe_webhook():
         except json.JSONDecodeError:
             return jsonify({'error': 'Invalid JSON payload'}), 400
     else:
+        stripe = get_stripe()
         try:
             event = stripe.Webhook.construct_event(
                 payload, sig_header, STRIPE_WEBHOOK_SECRET
@@ -777,55 +2996,28 @@ def stripe_webhook():
         except stripe.error.SignatureVerificationError:
             return jsonify({'error': 'Invalid signature'}), 400
 
-    # Handle checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-
-        # Get user ID and metaphor ID from client_reference_id (format: "userId_metaphorId")
-        client_reference_id = session.get('client_reference_id')
-        customer_email = session.get('customer_details', {}).get('email')
-
-        print(f"Payment completed - client_reference_id: {client_reference_id}, email: {customer_email}")
+    # Only checkout.session.completed grants anything
+    if event['type'] != 'checkout.session.completed':
+        return jsonify({'received': True}), 200
 
-        if client_reference_id and '_' in client_reference_id:
-            try:
-                user_uuid, metaphor_id = client_reference_id.split('_', 1)
+    try:
+        queued = webhook_queue.enqueue(event)
+    except Exception as e:
+        # Not recorded, or not fulfilled while still pending - let Stripe redeliver
+        print(f"Webhook enqueue failed: {e}")
+        return jsonify({'error': 'Could not process event'}), 500
 
-                # Look up user by uuid
-                user_result = supabase.table('users')\
-                    .select('uuid, email, name')\
-                    .eq('uuid', user_uuid)\
-                    .single()\
-                    .execute()
+    return jsonify({'received': True, 'queued': queued}), 200
 
-                if user_result.data:
-                    user = user_result.data
-
-                    # Check if already purchased
-                    existing = supabase.table('user_purchases')\
-                        .select('id')\
-                        .eq('user_uuid', user['uuid'])\
-                        .eq('metaphor_id', metaphor_id)\
-                        .execute()
-
-                    if not existing.data:
-                        # Insert purchase record
-                        supabase.table('user_purchases').insert({
-                            'user_uuid': user['uuid'],
-                            'metaphor_id': metaphor_id,
-                            'email': user['email'],
-                            'name': user['name'],
-                            'price_paid': '5.00'
-                        }).execute()
-                        print(f"Purchase recorded: user={user['email']}, metaphor={metaphor_id}")
-                    else:
-                        print(f"Already purchased: user={user['email']}, metaphor={metaphor_id}")
-                else:
-                    print(f"User not found: {user_uuid}")
-            except Exception as e:
-                print(f"Error processing payment: {e}")
+@app.cli.command('drain-webhooks')
+def drain_webhooks_command():
+    """Fulfil Stripe events still pending (flask --app app drain-webhooks)"""
+    print(f"Drained {webhook_queue.drain_pending()} pending Stripe events")
 
-    return jsonify({'received': True}), 200
+@app.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    """Delete all expired sessions (flask --app app sweep-sessions)"""
+    print(f"Removed {session_sweeper.sweep()} expired sessions")
 
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=8080)
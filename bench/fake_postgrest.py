@@ -0,0 +1,331 @@
+"""In-memory stand-in for the slice of PostgREST that app.py uses.
+
+Serves /rest/v1/<table> with the filters the Supabase client sends
+(eq/neq/gt/gte/lt/lte/in/is, order, limit, select), single-object Accept
+headers, insert/upsert (on_conflict, merge or ignore duplicates),
+update and delete. It also serves the RPCs documented in README.md under
+/rest/v1/rpc/<name>. Every response is delayed by latency_ms plus up to
+jitter_ms, to stand in for the network hop to Supabase.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Query parameters that are not column filters
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+UNIQUE_KEYS = {
+    'users': ['google_id'],
+    'sessions': ['token'],
+    'universal_subscription': ['email'],
+    'user_purchases': ['user_uuid', 'metaphor_id'],
+    'stripe_events': ['event_id'],
+    'interview_invites': ['token'],
+    'revoked_sessions': ['jti']
+}
+
+class PostgrestError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.body = {'code': code, 'message': message, 'details': None, 'hint': None}
+
+def parse_list(value):
+    """'(a,"b,c",d)' -> ['a', 'b,c', 'd']"""
+    items, current, quoted = [], '', False
+    for char in value.strip('()'):
+        if char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            items.append(current)
+            current = ''
+        else:
+            current += char
+    items.append(current)
+    return [item for item in items if item != '']
+
+def coerce(row_value, text):
+    """Compare numbers as numbers and everything else as text"""
+    if isinstance(row_value, bool):
+        return str(row_value).lower(), text.lower()
+    if isinstance(row_value, (int, float)):
+        try:
+            return row_value, float(text)
+        except ValueError:
+            pass
+    return str(row_value), text
+
+def matches(row, column, expression):
+    op, _, value = expression.partition('.')
+    value = value.strip('"')
+    row_value = row.get(column)
+    if op == 'is':
+        return (row_value is None) == (value == 'null')
+    if op == 'in':
+        return row_value is not None and str(row_value) in parse_list(value)
+    if row_value is None:
+        return False
+    left, right = coerce(row_value, value)
+    return {
+        'eq': left == right,
+        'neq': left != right,
+        'gt': left > right,
+        'gte': left >= right,
+        'lt': left < right,
+        'lte': left <= right
+    }[op]
+
+class Store:
+    """Tables of dict rows behind one lock, plus the app's RPCs"""
+
+    def __init__(self):
+        self.tables = {}
+        self.calls = 0
+        self._sequence = 0
+        self._lock = threading.RLock()
+
+    def rows(self, table):
+        return self.tables.setdefault(table, [])
+
+    def _next_id(self):
+        self._sequence += 1
+        return self._sequence
+
+    def _find_conflict(self, table, row, keys):
+        for existing in self.rows(table):
+            if all(str(existing.get(k)) == str(row.get(k)) for k in keys):
+                return existing
+        return None
+
+    def insert(self, table, rows, on_conflict=None, resolution=None):
+        """Insert rows; on a unique clash merge, skip or raise like PostgREST"""
+        keys = on_conflict.split(',') if on_conflict else UNIQUE_KEYS.get(table)
+        out = []
+        with self._lock:
+            for row in rows:
+                row = dict(row)
+                existing = self._find_conflict(table, row, keys) if keys else None
+                if existing is not None:
+                    if resolution == 'ignore':
+                        continue
+                    if resolution != 'merge':
+                        raise PostgrestError(409, '23505', f'duplicate key value violates unique constraint "{table}_key"')
+                    existing.update(row)
+                    out.append(dict(existing))
+                    continue
+                row.setdefault('id', self._next_id())
+                row.setdefault('created_at', datetime.utcnow().isoformat())
+                if table == 'users':
+                    row.setdefault('uuid', str(uuid.uuid4()))
+                self.rows(table).append(row)
+                out.append(dict(row))
+        return out
+
+    def select(self, table, filters, columns='*', order=None, limit=None, offset=0):
+        with self._lock:
+            out = [dict(r) for r in self.rows(table) if all(matches(r, c, e) for c, e in filters)]
+        for term in reversed((order or '').split(',') if order else []):
+            column, *flags = term.split('.')
+            out.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse='desc' in flags)
+        out = out[offset:offset + limit if limit else None]
+        if columns != '*':
+            names = [c.strip() for c in columns.split(',')]
+            out = [{n: r.get(n) for n in names} for r in out]
+        return out
+
+    def update(self, table, filters, values):
+        with self._lock:
+            out = []
+            for row in self.rows(table):
+                if all(matches(row, c, e) for c, e in filters):
+                    row.update(values)
+                    out.append(dict(row))
+            return out
+
+    def delete(self, table, filters):
+        with self._lock:
+            rows = self.rows(table)
+            doomed = [r for r in rows if all(matches(r, c, e) for c, e in filters)]
+            self.tables[table] = [r for r in rows if r not in doomed]
+            return doomed
+
+    # --- RPCs (mirroring the SQL functions in README.md) ---
+
+    def rpc_login_google_user(self, p_google_id, p_email, p_name, p_token, p_expires_at):
+        with self._lock:
+            user = self.insert('users', [{'google_id': p_google_id, 'email': p_email, 'name': p_name, 'provider': 'google'}],
+                               on_conflict='google_id', resolution='merge')[0]
+            if p_token is not None:
+                self.insert('sessions', [{'user_uuid': user['uuid'], 'token': p_token,
+                                          'expires_at': p_expires_at, 'google_id': p_google_id}])
+            return user
+
+    def rpc_grant_metaphors(self, p_user_uuid, p_metaphor_ids):
+        with self._lock:
+            user = next((u for u in self.rows('users') if u['uuid'] == p_user_uuid), None)
+            if user is None:
+                return [{'metaphor_id': m, 'granted': False} for m in p_metaphor_ids]
+            inserted = self.insert('user_purchases', [
+                {'user_uuid': p_user_uuid, 'metaphor_id': m, 'email': user['email'], 'name': user['name'], 'price_paid': '5.00'}
+                for m in p_metaphor_ids
+            ], resolution='ignore')
+            granted = {row['metaphor_id'] for row in inserted}
+            return [{'metaphor_id': m, 'granted': m in granted} for m in p_metaphor_ids]
+
+    def rpc_submit_interview(self, p_token, p_responses, p_idempotency_key=None):
+        with self._lock:
+            invite = next((i for i in self.rows('interview_invites') if i['token'] == p_token), None)
+            if invite is None:
+                return 'invalid'
+            if invite['status'] != 'completed':
+                invite.update(status='completed', completed_at=datetime.utcnow().isoformat())
+                self.insert('interview_responses', [{
+                    'invite_id': invite['id'], 'token': p_token, 'candidate_email': invite['candidate_email'],
+                    'candidate_name': invite['candidate_name'], 'responses': p_responses,
+                    'idempotency_key': p_idempotency_key
+                }])
+                return 'submitted'
+            if p_idempotency_key and any(r['token'] == p_token and r.get('idempotency_key') == p_idempotency_key
+                                         for r in self.rows('interview_responses')):
+                return 'duplicate'
+            return 'already_submitted'
+
+    def rpc_purge_expired_sessions(self, p_batch_size=1000):
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            doomed = [s for s in self.rows('sessions') if s['expires_at'] < now][:p_batch_size]
+            self.tables['sessions'] = [s for s in self.rows('sessions') if s not in doomed]
+            return len(doomed)
+
+def seed(store, metaphors=24, invites=1000, content_bytes=8000):
+    """Fill the store with a catalog shaped like production's, plus pending interview invites"""
+    words = 'the player reads the table and folds when the odds turn against them'.split()
+
+    def text(size):
+        return ' '.join(random.choice(words) for _ in range(size // 5))[:size]
+
+    ids = [f'metaphor-{i}' for i in range(metaphors)]
+    store.insert('metaphors', [{
+        'id': metaphor_id,
+        'title': metaphor_id.replace('-', ' ').title(),
+        'symbol': '♠',
+        'keywords': random.sample(words, 3),
+        'doctrine': text(200),
+        'preview_content': text(content_bytes // 8),
+        'full_content': text(content_bytes),
+        'price': '5.00',
+        'status': 'available' if i % 4 else 'coming_soon',
+        'order_index': i
+    } for i, metaphor_id in enumerate(ids)])
+    store.insert('bundles', [
+        {'id': 'starter', 'name': 'Starter', 'description': text(100), 'price': '12.00',
+         'metaphor_ids': ids[:3], 'status': 'active', 'discount_percent': 20},
+        {'id': 'complete', 'name': 'Complete', 'description': text(100), 'price': '60.00',
+         'metaphor_ids': ids, 'status': 'active', 'discount_percent': 50}
+    ])
+    expires_at = (datetime.utcnow() + timedelta(days=14)).isoformat()
+    store.insert('interview_invites', [{
+        'token': f'invite-{i}', 'candidate_email': f'candidate{i}@example.com', 'candidate_name': f'Candidate {i}',
+        'position': 'Design Intern', 'status': 'pending', 'expires_at': expires_at
+    } for i in range(invites)])
+    return ids
+
+class FakePostgrest:
+    """Threaded HTTP server answering PostgREST requests from a Store"""
+
+    def __init__(self, store, latency_ms=0, jitter_ms=0, host='127.0.0.1', port=0):
+        self.store = store
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='fake-postgrest', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def delay(self):
+        delay_ms = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length)) if length else None
+
+            def _handle(self):
+                fake.delay()
+                fake.store.calls += 1
+                url = urlsplit(self.path)
+                parts = url.path.rstrip('/').split('/')
+                params = parse_qsl(url.query, keep_blank_values=True)
+                options = {k: v for k, v in params if k in RESERVED_PARAMS}
+                filters = [(k, v) for k, v in params if k not in RESERVED_PARAMS]
+                prefer = self.headers.get('Prefer', '')
+                single = 'vnd.pgrst.object' in self.headers.get('Accept', '')
+                # Always drain the body: the client sends '{}' even on GET, which would
+                # otherwise be read as the start of the next keep-alive request
+                body = self._body()
+
+                try:
+                    if len(parts) >= 2 and parts[-2] == 'rpc':
+                        handler = getattr(fake.store, f'rpc_{parts[-1]}', None)
+                        if handler is None:
+                            raise PostgrestError(404, 'PGRST202', f'Could not find the function {parts[-1]}')
+                        return self._reply(200, handler(**(body or {})))
+
+                    table = parts[-1]
+                    if self.command == 'GET':
+                        rows = fake.store.select(table, filters, options.get('select', '*'), options.get('order'),
+                                                 int(options['limit']) if 'limit' in options else None,
+                                                 int(options.get('offset', 0)))
+                    elif self.command == 'POST':
+                        resolution = 'merge' if 'merge-duplicates' in prefer else 'ignore' if 'ignore-duplicates' in prefer else None
+                        rows = fake.store.insert(table, body if isinstance(body, list) else [body],
+                                                 options.get('on_conflict'), resolution)
+                    elif self.command == 'PATCH':
+                        rows = fake.store.update(table, filters, body)
+                    else:
+                        rows = fake.store.delete(table, filters)
+
+                    if single:
+                        if len(rows) != 1:
+                            raise PostgrestError(406, 'PGRST116', 'JSON object requested, multiple (or no) rows returned')
+                        return self._reply(200, rows[0])
+                    return self._reply(201 if self.command == 'POST' else 200, rows)
+                except PostgrestError as e:
+                    return self._reply(e.status, e.body)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+        return Handler
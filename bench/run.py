@@ -0,0 +1,293 @@
+"""Offline load test for app.py against a local PostgREST stand-in.
+
+Usage:
+    python bench/run.py [--scenarios gallery,login] [--requests 200] [--concurrency 8]
+                        [--latency-ms 20] [--jitter-ms 10] [--save out.json] [--baseline old.json]
+
+The app runs in-process on a threaded local server. Supabase is replaced by
+bench/fake_postgrest.py, Google ID tokens by a stub verifier, and Stripe
+webhooks are signed locally with a bench secret. Nothing leaves the machine.
+Each scenario runs --requests iterations spread over --concurrency client
+threads. It prints p50/p95/p99 latency and throughput per route. --save
+writes the numbers as JSON, and --baseline prints p95 changes against an
+earlier --save.
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_postgrest import FakePostgrest, Store, seed
+
+STRIPE_WEBHOOK_SECRET = 'whsec_bench'
+GOOGLE_CLIENT_ID = 'bench-client-id'
+
+def google_id_token(n):
+    """An unsigned stand-in ID token; only the stub verifier accepts it"""
+    claims = {
+        'iss': 'https://accounts.google.com',
+        'aud': GOOGLE_CLIENT_ID,
+        'sub': f'google-{n}',
+        'email': f'user{n}@example.com',
+        'name': f'User {n}',
+        'picture': None,
+        'exp': int(time.time()) + 3600
+    }
+    return 'bench.' + base64.urlsafe_b64encode(json.dumps(claims).encode('utf-8')).decode('ascii')
+
+def stub_decode_google_token(token):
+    """Replaces app.decode_google_token: trusts the claims, keeps the rest of the login path"""
+    prefix, _, payload = token.partition('.')
+    if prefix != 'bench':
+        raise ValueError('Not a bench token')
+    return json.loads(base64.urlsafe_b64decode(payload))
+
+def signed_stripe_event(client_reference_id, secret=STRIPE_WEBHOOK_SECRET):
+    """A checkout.session.completed event and the Stripe-Signature header Stripe would send"""
+    payload = json.dumps({
+        'id': f'evt_{uuid.uuid4().hex}',
+        'object': 'event',
+        'type': 'checkout.session.completed',
+        'data': {'object': {
+            'object': 'checkout.session',
+            'client_reference_id': client_reference_id,
+            'customer_details': {'email': 'buyer@example.com'}
+        }}
+    }).encode('utf-8')
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode('utf-8'), f'{timestamp}.'.encode('utf-8') + payload, hashlib.sha256).hexdigest()
+    return payload, {'Stripe-Signature': f't={timestamp},v1={signature}', 'Content-Type': 'application/json'}
+
+class Recorder:
+    """Latency samples and failures per route label"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, label, elapsed_ms, ok):
+        with self._lock:
+            self.samples.setdefault(label, []).append(elapsed_ms)
+            if not ok:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+class Client:
+    """One virtual user: a keep-alive HTTP session that times each call"""
+
+    def __init__(self, base_url, recorder):
+        import requests
+        self.base_url = base_url
+        self.recorder = recorder
+        self.session = requests.Session()
+        self.token = None
+
+    def call(self, method, path, label=None, expect=(200,), **kwargs):
+        headers = kwargs.pop('headers', {})
+        if self.token:
+            headers.setdefault('Authorization', f'Bearer {self.token}')
+        start = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.recorder.record(label or f'{method} {path}', elapsed_ms, response.status_code in expect)
+        return response
+
+    def login(self, n):
+        response = self.call('POST', '/api/auth/google', json={'idToken': google_id_token(n)})
+        body = response.json()
+        self.token = body['session']['token']
+        return body['user']
+
+# --- Scenarios: each runs one iteration for virtual user n ---
+
+def gallery(client, n, ctx):
+    client.call('GET', '/metaphors', 'GET /metaphors (page)')
+    client.call('GET', '/api/library')
+    client.call('GET', '/api/bundles')
+    metaphor_id = random.choice(ctx['metaphor_ids'])
+    client.call('GET', f'/metaphors/{metaphor_id}', 'GET /metaphors/<id> (page)', expect=(200,))
+
+def login(client, n, ctx):
+    client.login(n)
+    client.call('GET', '/api/auth/me')
+
+def bundle_purchase(client, n, ctx):
+    if client.token is None:
+        client.login(n)
+    client.call('POST', '/api/purchase/bundle/starter', 'POST /api/purchase/bundle/<id>')
+    client.call('GET', '/api/library', 'GET /api/library (signed in)')
+    metaphor_id = random.choice(ctx['metaphor_ids'])
+    client.call('GET', f'/api/metaphors/{metaphor_id}/content', 'GET /api/metaphors/<id>/content')
+
+def webhook_burst(client, n, ctx):
+    user_uuid = ctx['buyers'][n % len(ctx['buyers'])]
+    payload, headers = signed_stripe_event(f"{user_uuid}_{random.choice(ctx['metaphor_ids'])}")
+    client.call('POST', '/api/stripe/webhook', data=payload, headers=headers)
+
+def interview_submit(client, n, ctx):
+    token = f'invite-{n}'
+    client.call('GET', f'/interview/{token}', 'GET /interview/<token>')
+    client.call('POST', '/api/interview/submit', json={'token': token, 'responses': {'q1': 'answer'}},
+                headers={'Idempotency-Key': str(uuid.uuid4())})
+
+SCENARIOS = {
+    'gallery': gallery,
+    'login': login,
+    'bundle_purchase': bundle_purchase,
+    'webhook_burst': webhook_burst,
+    'interview_submit': interview_submit
+}
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+def summarize(recorder, wall_seconds):
+    results = {}
+    for label, samples in recorder.samples.items():
+        samples = sorted(samples)
+        results[label] = {
+            'count': len(samples),
+            'errors': recorder.errors.get(label, 0),
+            'p50_ms': round(percentile(samples, 50), 2),
+            'p95_ms': round(percentile(samples, 95), 2),
+            'p99_ms': round(percentile(samples, 99), 2),
+            'mean_ms': round(statistics.fmean(samples), 2),
+            'rps': round(len(samples) / wall_seconds, 1)
+        }
+    return results
+
+def print_table(name, results, wall_seconds, baseline=None):
+    print(f'\n{name} ({wall_seconds:.2f}s)')
+    print(f"  {'route':<40} {'n':>6} {'err':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8}")
+    for label, r in sorted(results.items()):
+        line = (f"  {label:<40} {r['count']:>6} {r['errors']:>5} {r['p50_ms']:>8.1f} "
+                f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['rps']:>8.1f}")
+        before = (baseline or {}).get(name, {}).get(label)
+        if before:
+            change = (r['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            line += f'   p95 {change:+.0f}%'
+        print(line)
+
+def start_app(backend_url, quiet):
+    """Configure the environment, import app against the fake backend and serve it locally"""
+    os.environ['SUPABASE_URL'] = backend_url
+    os.environ['SUPABASE_KEY'] = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench'
+    os.environ['SUPABASE_HTTP2'] = '0'
+    os.environ['STRIPE_WEBHOOK_SECRET'] = STRIPE_WEBHOOK_SECRET
+    os.environ['GOOGLE_CLIENT_ID'] = GOOGLE_CLIENT_ID
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    os.environ.setdefault('PROXY_HOPS', '0')
+    os.environ.setdefault('SESSION_SWEEP_INTERVAL_SECONDS', '0')
+    os.environ.setdefault('WRITE_BUFFER_SPILL_DIR', tempfile.mkdtemp(prefix='bench-write-buffer-'))
+
+    import app
+    from werkzeug.serving import make_server
+
+    app.decode_google_token = stub_decode_google_token
+    # Build the Supabase client up front: this measures steady state, and
+    # startup_benchmark.py covers cold starts
+    app.supabase.postgrest
+    if quiet:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return app, f'http://127.0.0.1:{server.server_port}'
+
+def run_scenario(name, base_url, requests_count, concurrency, ctx):
+    recorder = Recorder()
+    clients = [Client(base_url, recorder) for _ in range(concurrency)]
+    scenario = SCENARIOS[name]
+
+    def worker(worker_index):
+        client = clients[worker_index]
+        for n in range(worker_index, requests_count, concurrency):
+            try:
+                scenario(client, n, ctx)
+            except Exception as e:
+                recorder.record(f'{name} (exception)', 0, False)
+                print(f'{name} iteration {n} failed: {e}', file=sys.stderr)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return recorder, time.perf_counter() - start
+
+def wait_for_webhooks(app, timeout=30):
+    """Seconds until the webhook queue has fulfilled everything it accepted"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        stats = app.webhook_queue.stats()
+        if stats['processed'] + stats['skipped'] + stats['failed'] >= stats['enqueued'] and not stats['retrying']:
+            break
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='iterations per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=20, help='fixed delay added to every Supabase call')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='random extra delay, up to this much')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare p95 against an earlier --save')
+    parser.add_argument('--verbose', action='store_true', help="show the app's own output")
+    args = parser.parse_args()
+
+    names = [s for s in args.scenarios.split(',') if s]
+    unknown = [s for s in names if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}; choose from {', '.join(SCENARIOS)}")
+
+    random.seed(args.seed)
+    store = Store()
+    metaphor_ids = seed(store, invites=args.requests)
+    buyers = [u['uuid'] for u in store.insert('users', [
+        {'google_id': f'buyer-{i}', 'email': f'buyer{i}@example.com', 'name': f'Buyer {i}'} for i in range(50)
+    ])]
+    backend = FakePostgrest(store, args.latency_ms, args.jitter_ms).start()
+    app, base_url = start_app(backend.url, quiet=not args.verbose)
+    ctx = {'metaphor_ids': metaphor_ids, 'buyers': buyers}
+    baseline = json.load(open(args.baseline)) if args.baseline else None
+
+    print(f'{args.requests} iterations x {len(names)} scenarios, {args.concurrency} clients, '
+          f'Supabase latency {args.latency_ms:g}+{args.jitter_ms:g} ms')
+    report = {}
+    for name in names:
+        calls_before = store.calls
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            recorder, wall_seconds = run_scenario(name, base_url, args.requests, args.concurrency, ctx)
+            drain_seconds = wait_for_webhooks(app) if name == 'webhook_burst' else None
+        report[name] = summarize(recorder, wall_seconds)
+        print_table(name, report[name], wall_seconds, baseline)
+        print(f'  Supabase calls: {store.calls - calls_before}')
+        if drain_seconds is not None:
+            print(f'  webhook queue drained {drain_seconds:.2f}s after the last ack: {app.webhook_queue.stats()}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'\nSaved results to {args.save}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Build fingerprinted, precompressed copies of the static assets.
+
+Usage:
+    python build_assets.py [--out build/static]
+
+Every non-HTML file under views/, logos/ and images/ is copied to
+<out>/<dir>/<name>.<hash>.<ext>. HTML pages are copied under their original
+names with asset references rewritten to the hashed names. Compressible files
+get .gz siblings, and .br siblings when the optional `brotli` package is
+installed. app.py serves from this directory when <out>/manifest.json exists.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSET_DIRS = ['views', 'logos', 'images']
+COMPRESSIBLE_EXTENSIONS = {'.html', '.js', '.css', '.json', '.svg', '.txt', '.xml'}
+MIN_COMPRESS_BYTES = 512
+
+# "/views/js/auth.js", "../logos/logo.jpg" and similar references inside HTML
+ASSET_REFERENCE = re.compile(r'''(?P<prefix>["'(])(?:\.\./|/)(?P<path>(?:views|logos|images)/[^"'()?#\s]+)''')
+
+def fingerprint(path, content):
+    """Insert a content hash before the extension: js/auth.js -> js/auth.1a2b3c4d5e.js"""
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    base, ext = os.path.splitext(path)
+    return f'{base}.{digest}{ext}'
+
+def write_variants(out_dir, rel_path, content):
+    """Write a file plus its .gz/.br siblings; return the encodings produced"""
+    target = os.path.join(out_dir, rel_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(content)
+
+    encodings = []
+    if os.path.splitext(rel_path)[1].lower() not in COMPRESSIBLE_EXTENSIONS or len(content) < MIN_COMPRESS_BYTES:
+        return encodings
+
+    if brotli is not None:
+        compressed = brotli.compress(content, quality=11)
+        if len(compressed) < len(content):
+            with open(target + '.br', 'wb') as f:
+                f.write(compressed)
+            encodings.append('br')
+
+    compressed = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(compressed) < len(content):
+        with open(target + '.gz', 'wb') as f:
+            f.write(compressed)
+        encodings.append('gzip')
+    return encodings
+
+def collect_files():
+    """Yield repo-relative paths of every file under the asset directories"""
+    for asset_dir in ASSET_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(ROOT, asset_dir)):
+            for filename in sorted(filenames):
+                if filename.startswith('.'):
+                    continue
+                yield os.path.relpath(os.path.join(dirpath, filename), ROOT).replace(os.sep, '/')
+
+def rewrite_references(html, files):
+    """Point asset references at their fingerprinted names"""
+    def replace(match):
+        hashed = files.get(match.group('path'))
+        if not hashed:
+            return match.group(0)
+        return f"{match.group('prefix')}/{hashed}"
+    return ASSET_REFERENCE.sub(replace, html)
+
+def build(out_dir):
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    files = {}
+    pages = []
+    encodings = {}
+
+    paths = list(collect_files())
+    for path in paths:
+        if path.endswith('.html'):
+            pages.append(path)
+            continue
+        with open(os.path.join(ROOT, path), 'rb') as f:
+            content = f.read()
+        hashed = fingerprint(path, content)
+        files[path] = hashed
+        encodings[hashed] = write_variants(out_dir, hashed, content)
+
+    for path in pages:
+        with open(os.path.join(ROOT, path), 'r', encoding='utf-8') as f:
+            html = rewrite_references(f.read(), files)
+        encodings[path] = write_variants(out_dir, path, html.encode('utf-8'))
+
+    manifest = {'files': files, 'pages': pages, 'encodings': encodings}
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    print(f"Built {len(files)} assets and {len(pages)} pages into {out_dir}"
+          f"{'' if brotli else ' (brotli not installed, gzip only)'}")
+    return manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', default=os.path.join(ROOT, 'build', 'static'))
+    args = parser.parse_args()
+    build(args.out)
@@ -0,0 +1,131 @@
+"""Transcode images under logos/ and images/ into smaller responsive variants.
+
+Usage:
+    python build_media.py [--out build/media] [--widths 320,640,1280]
+
+For every JPEG/PNG/GIF this writes WebP and AVIF copies at the original width
+and at each smaller configured width. It also writes resized copies in the
+original format for clients that accept neither. Animated GIFs become
+animated WebP. Variant names carry
+the source content hash, e.g. logos/logo.aed5785c05.w640.webp. app.py reads
+<out>/manifest.json and negotiates a variant from the Accept header and an
+optional ?w= parameter.
+
+Requires Pillow (pip install Pillow); AVIF output needs a Pillow build with
+AVIF support and is skipped otherwise.
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+
+from build_assets import ROOT, fingerprint
+
+try:
+    from PIL import Image, ImageSequence, features
+except ImportError:
+    Image = None
+
+MEDIA_DIRS = ['logos', 'images']
+SOURCE_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif'}
+DEFAULT_WIDTHS = [320, 640, 1280]
+QUALITY = {'webp': 80, 'avif': 60, 'jpeg': 82}
+
+def encode(image, fmt, animated):
+    """Encode a Pillow image (all frames when animated) and return the bytes"""
+    out = io.BytesIO()
+    if fmt == 'jpeg':
+        image.convert('RGB').save(out, 'JPEG', quality=QUALITY['jpeg'], optimize=True, progressive=True)
+    elif fmt == 'png':
+        image.save(out, 'PNG', optimize=True)
+    elif fmt == 'gif':
+        image.save(out, 'GIF', save_all=animated, optimize=True)
+    elif animated:
+        frames = [frame.convert('RGBA') for frame in ImageSequence.Iterator(image)]
+        frames[0].save(out, 'WEBP', save_all=True, append_images=frames[1:], quality=QUALITY['webp'],
+                       duration=image.info.get('duration', 100), loop=image.info.get('loop', 0))
+    else:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(out, fmt.upper(), quality=QUALITY[fmt])
+    return out.getvalue()
+
+def resize(image, width, animated):
+    """Scale an image (every frame when animated) to the given width"""
+    if width >= image.width:
+        return image
+    height = round(image.height * width / image.width)
+    if not animated:
+        return image.resize((width, height), Image.LANCZOS)
+
+    frames = [frame.convert('RGBA').resize((width, height), Image.LANCZOS) for frame in ImageSequence.Iterator(image)]
+    out = io.BytesIO()
+    frames[0].save(out, 'GIF', save_all=True, append_images=frames[1:],
+                   duration=image.info.get('duration', 100), loop=image.info.get('loop', 0), disposal=2)
+    return Image.open(io.BytesIO(out.getvalue()))
+
+def build(out_dir, widths):
+    if Image is None:
+        raise SystemExit('build_media.py requires Pillow: pip install Pillow')
+
+    formats = ['webp'] + (['avif'] if features.check('avif') else [])
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    originals = {}
+    variants = {}
+    for media_dir in MEDIA_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(ROOT, media_dir)):
+            for filename in sorted(filenames):
+                source_type = SOURCE_TYPES.get(os.path.splitext(filename)[1].lower())
+                if not source_type:
+                    continue
+
+                source_file = os.path.join(dirpath, filename)
+                source = os.path.relpath(source_file, ROOT).replace(os.sep, '/')
+                with open(source_file, 'rb') as f:
+                    content = f.read()
+                hashed_base = os.path.splitext(fingerprint(source, content))[0]
+
+                image = Image.open(io.BytesIO(content))
+                animated = getattr(image, 'is_animated', False)
+                originals[source] = {'type': source_type, 'width': image.width, 'bytes': len(content)}
+
+                entries = []
+                sizes = sorted({w for w in widths if w < image.width} | {image.width})
+                for width in sizes:
+                    scaled = resize(image, width, animated)
+                    own_format = source_type.split('/')[1]
+                    # Animated AVIF is not widely supported by Pillow; the WebP covers it
+                    targets = [f for f in formats if not (animated and f == 'avif')]
+                    if width < image.width:
+                        targets.append(own_format)
+                    for fmt in targets:
+                        data = encode(scaled, fmt, animated)
+                        ext = 'jpg' if fmt == 'jpeg' else fmt
+                        rel_path = f'{hashed_base}.w{width}.{ext}'
+                        target = os.path.join(out_dir, rel_path)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with open(target, 'wb') as f:
+                            f.write(data)
+                        entries.append({'path': rel_path, 'type': f'image/{fmt}', 'width': width, 'bytes': len(data)})
+                variants[source] = entries
+
+    manifest = {'originals': originals, 'variants': variants}
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    saved = sum(o['bytes'] - min([o['bytes']] + [v['bytes'] for v in variants[s] if v['width'] == o['width']])
+                for s, o in originals.items())
+    print(f"Built variants for {len(originals)} images into {out_dir} "
+          f"({saved / 1024:.0f} KB smaller at full width; formats: {', '.join(formats)})")
+    return manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', default=os.path.join(ROOT, 'build', 'media'))
+    parser.add_argument('--widths', default=','.join(str(w) for w in DEFAULT_WIDTHS))
+    args = parser.parse_args()
+    build(args.out, [int(w) for w in args.widths.split(',') if w])
@@ -0,0 +1,107 @@
+"""Measure app.py cold start and report where import time goes.
+
+Usage:
+    python startup_benchmark.py [--runs 5] [--top 15] [--budget-ms 800]
+
+Each run starts a fresh interpreter with `-X importtime`, imports app and
+serves one page request (what a cold serverless invocation does). The report
+shows median import and first-request times, plus the slowest modules
+imported by app directly, by cumulative import time. The script exits
+non-zero when the median total exceeds --budget-ms, or when a heavy SDK that
+should load lazily (see DEFERRED_MODULES) was imported to serve the page.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Only needed once a route talks to Supabase, Stripe, Google or Redis
+DEFERRED_MODULES = ['supabase', 'postgrest', 'httpx', 'stripe', 'google.auth.jwt', 'requests', 'redis']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'request_ms': (served - imported) * 1000,
+    'status': response.status_code,
+    'loaded': [m for m in sys.argv[2:] if m in sys.modules]
+}))
+'''
+
+def parse_importtime(stderr):
+    """Return {module: cumulative_us} for the modules app imports directly"""
+    modules = {}
+    depth_of_app = None
+    lines = [line for line in stderr.splitlines() if line.startswith('import time:') and 'self [us]' not in line]
+    # -X importtime prints children before their parent, so walk backwards from app
+    for line in reversed(lines):
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if name == 'app':
+            depth_of_app = depth
+            continue
+        if depth_of_app is None:
+            continue
+        if depth <= depth_of_app:
+            break
+        if depth == depth_of_app + 1:
+            modules[name] = int(cumulative)
+    return modules
+
+def run_once(path):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, path] + DEFERRED_MODULES,
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f'Probe failed:\n{result.stderr[-2000:]}')
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['modules'] = parse_importtime(result.stderr)
+    return sample
+
+def benchmark(runs, path, top, budget_ms):
+    run_once(path)  # warm the bytecode cache, as a deployed bundle would be
+    samples = [run_once(path) for _ in range(runs)]
+
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    request_ms = statistics.median(s['request_ms'] for s in samples)
+    modules = {}
+    for sample in samples:
+        for name, cumulative in sample['modules'].items():
+            modules.setdefault(name, []).append(cumulative)
+
+    print(f"Cold start over {runs} runs (median): import app {import_ms:.0f} ms, "
+          f"first GET {path} {request_ms:.0f} ms (status {samples[-1]['status']})")
+    print('\nSlowest direct imports of app (cumulative, -X importtime):')
+    ranked = sorted(((statistics.median(v) / 1000, name) for name, v in modules.items()), reverse=True)
+    for ms, name in ranked[:top]:
+        print(f'  {ms:8.1f} ms  {name}')
+
+    failures = []
+    loaded = sorted(set().union(*(s['loaded'] for s in samples)))
+    if loaded:
+        failures.append(f"imported during a cold page request: {', '.join(loaded)}")
+    if budget_ms and import_ms + request_ms > budget_ms:
+        failures.append(f'{import_ms + request_ms:.0f} ms exceeds the {budget_ms} ms budget')
+    for failure in failures:
+        print(f'\nFAIL: {failure}')
+    return not failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/', help='page to request after import')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=0, help='fail if import + first request is slower')
+    args = parser.parse_args()
+    sys.exit(0 if benchmark(args.runs, args.path, args.top, args.budget_ms) else 1)
@@ -0,0 +1,53 @@
+"""Shared fixtures: app.py is imported once, against bench/fake_postgrest.py.
+
+The fake backend runs for the whole session on a local port. Each test gets
+its tables reset and a small catalog seeded, plus fresh in-process caches.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_postgrest import FakePostgrest, Store, seed
+
+STORE = Store()
+BACKEND = FakePostgrest(STORE).start()
+
+os.environ['SUPABASE_URL'] = BACKEND.url
+os.environ['SUPABASE_KEY'] = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.tests'
+os.environ['SUPABASE_HTTP2'] = '0'
+os.environ['SESSION_SIGNING_KEYS'] = 'k1:first-test-secret'
+os.environ['SESSION_SWEEP_INTERVAL_SECONDS'] = '0'
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+os.environ['PROXY_HOPS'] = '0'
+os.environ['WRITE_BUFFER_SPILL_DIR'] = tempfile.mkdtemp(prefix='tests-write-buffer-')
+
+import app as app_module
+
+METAPHORS = 6
+
+@pytest.fixture
+def store():
+    """The fake backend's tables, emptied and seeded with a small catalog"""
+    with STORE._lock:
+        STORE.tables.clear()
+    seed(STORE, metaphors=METAPHORS, invites=0, content_bytes=400)
+    return STORE
+
+@pytest.fixture
+def app(store, monkeypatch):
+    """The app module with empty catalog, session and revocation caches"""
+    monkeypatch.setattr(app_module, 'catalog', app_module.CatalogStore(app_module.CATALOG_REFRESH_SECONDS))
+    monkeypatch.setattr(app_module, 'session_cache', app_module.TTLCache(
+        app_module.SESSION_CACHE_MAX_ENTRIES, app_module.SESSION_CACHE_TTL_SECONDS))
+    monkeypatch.setattr(app_module, 'revoked_sessions', app_module.RevocationList(
+        app_module.SESSION_REVOCATION_SYNC_SECONDS, app_module.SESSION_REVOCATION_PAGE_SIZE))
+    return app_module
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
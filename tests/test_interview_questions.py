@@ -0,0 +1,41 @@
+"""Interview questions: served from memory, reloaded when the file changes"""
+import json
+import os
+
+import pytest
+
+@pytest.fixture
+def questions_file(app, tmp_path, monkeypatch):
+    path = tmp_path / 'interview_questions.json'
+    monkeypatch.setattr(app, 'INTERVIEW_QUESTIONS_FILE', str(path))
+    monkeypatch.setattr(app, 'interview_questions', app.QuestionStore(0))
+    return path
+
+def write(path, payload, mtime):
+    path.write_text(payload if isinstance(payload, str) else json.dumps(payload))
+    os.utime(path, (mtime, mtime))
+
+def fetch(client, position='Design Intern'):
+    return client.get(f'/api/interview/questions/{position}')
+
+def test_questions_follow_edits(app, client, questions_file):
+    write(questions_file, {'Design Intern': {'questions': ['one']}}, 1000)
+    assert fetch(client).get_json() == {'questions': ['one']}
+
+    write(questions_file, {'Design Intern': {'questions': ['two']}}, 2000)
+    assert fetch(client).get_json() == {'questions': ['two']}
+
+def test_last_good_copy_survives_a_broken_or_missing_file(app, client, questions_file):
+    write(questions_file, {'Design Intern': {'questions': ['one']}}, 1000)
+    assert fetch(client).status_code == 200
+
+    write(questions_file, '{"Design Intern": ', 2000)
+    assert fetch(client).get_json() == {'questions': ['one']}
+
+    os.remove(questions_file)
+    assert fetch(client).get_json() == {'questions': ['one']}
+    assert fetch(client, 'Chef').status_code == 404
+
+def test_missing_file_before_the_first_load_is_an_error(app, questions_file):
+    with pytest.raises(OSError):
+        app.interview_questions.get('Design Intern')
@@ -0,0 +1,86 @@
+"""GET /api/metaphors: fields=, limit= and keyset pagination with Link headers"""
+import re
+
+import pytest
+
+from conftest import METAPHORS
+
+def next_link(response):
+    match = re.fullmatch(r'<(.+)>; rel="next"', response.headers.get('Link', ''))
+    return match.group(1) if match else None
+
+def test_cursor_round_trip(app):
+    metaphor = {'id': 'metaphor-3', 'order_index': 3}
+
+    assert app.decode_metaphor_cursor(app.encode_metaphor_cursor(metaphor)) == app.metaphor_sort_key(metaphor)
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    'e30',
+    '',
+    'WzAsInRocmVlIiwibWV0YXBob3ItMyJd'
+])
+def test_malformed_cursor_is_rejected(app, cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        app.decode_metaphor_cursor(cursor)
+
+def test_bad_cursor_is_a_400(client):
+    response = client.get('/api/metaphors?limit=2&after=garbage')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+
+@pytest.mark.parametrize('limit, error', [
+    ('two', 'limit must be an integer'),
+    ('0', 'limit must be at least 1'),
+    ('-5', 'limit must be at least 1')
+])
+def test_bad_limit_is_a_400(client, limit, error):
+    response = client.get(f'/api/metaphors?limit={limit}')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+def test_pages_follow_link_until_the_last(client):
+    url = '/api/metaphors?limit=4'
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append([m['id'] for m in response.get_json()])
+        url = next_link(response)
+
+    assert pages == [
+        [f'metaphor-{i}' for i in range(4)],
+        [f'metaphor-{i}' for i in range(4, METAPHORS)]
+    ]
+
+def test_exact_last_page_has_no_link(client):
+    first = client.get(f'/api/metaphors?limit={METAPHORS // 2}')
+    last = client.get(next_link(first))
+
+    assert len(last.get_json()) == METAPHORS // 2
+    assert 'Link' not in last.headers
+
+def test_link_keeps_fields(client):
+    response = client.get('/api/metaphors?limit=2&fields=title')
+
+    assert response.get_json()[0] == {'id': 'metaphor-0', 'title': 'Metaphor 0'}
+    assert 'fields=id%2Ctitle' in next_link(response)
+    assert client.get(next_link(response)).get_json()[0] == {'id': 'metaphor-2', 'title': 'Metaphor 2'}
+
+def test_unpaged_list_has_no_link(client):
+    response = client.get('/api/metaphors')
+
+    assert len(response.get_json()) == METAPHORS
+    assert 'Link' not in response.headers
+
+def test_full_content_is_never_listed(client):
+    response = client.get('/api/metaphors?fields=full_content')
+    assert response.status_code == 400
+
+    cards = client.get('/api/metaphors?fields=preview_content').get_json()
+    detail = client.get('/api/metaphors/metaphor-1').get_json()
+    for metaphor in cards + [detail]:
+        assert 'full_content' not in metaphor
+        assert 'content_json' not in metaphor
@@ -0,0 +1,43 @@
+"""HTML pages: served from memory, compressed, with ETags"""
+import gzip
+
+import pytest
+
+@pytest.fixture
+def built(app, tmp_path, monkeypatch):
+    """A build_assets.py output holding one page with a prebuilt .gz sibling"""
+    views = tmp_path / 'views'
+    views.mkdir()
+    body = b'<html>' + b'built page ' * 200 + b'</html>'
+    (views / 'apple-home.html').write_bytes(body)
+    (views / 'apple-home.html.gz').write_bytes(gzip.compress(body, mtime=0))
+    manifest = {'files': {}, 'pages': ['views/apple-home.html'], 'encodings': {'views/apple-home.html': ['gzip']}}
+
+    monkeypatch.setattr(app, 'STATIC_BUILD_DIR', str(tmp_path))
+    monkeypatch.setattr(app, 'ASSET_MANIFEST', manifest)
+    monkeypatch.setattr(app, 'BUILT_PAGES', set(manifest['pages']))
+    monkeypatch.setattr(app, 'pages', app.PageRegistry(False))
+    return body
+
+def test_built_page_uses_prebuilt_variants(app, client, built, monkeypatch):
+    def no_compression(*args, **kwargs):
+        raise AssertionError('built pages must not be compressed at request time')
+    monkeypatch.setattr(app.gzip, 'compress', no_compression)
+
+    plain = client.get('/', headers={'Accept-Encoding': 'identity'})
+    gzipped = client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+
+    assert plain.data == built
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.data) == built
+    assert gzipped.headers['ETag'] == plain.headers['ETag'][:-1] + '-gz"'
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
+
+def test_source_page_is_compressed_once(app, client, monkeypatch):
+    monkeypatch.setattr(app, 'pages', app.PageRegistry(False))
+
+    first = client.get('/product', headers={'Accept-Encoding': 'gzip'})
+    again = client.get('/product', headers={'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']})
+
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert again.status_code == 304
@@ -0,0 +1,102 @@
+"""Token-bucket rate limits: capacity, refill, shedding and the Redis fallback"""
+import pytest
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FailingStore:
+    def take(self, key, capacity, refill_per_second):
+        raise ConnectionError('redis unreachable')
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app.time, 'monotonic', clock)
+    return clock
+
+def test_parse_rate(app):
+    assert app.parse_rate('10/60') == (10, 10 / 60)
+
+def test_bucket_allows_capacity_then_sheds(app, clock):
+    buckets = app.MemoryBucketStore(100)
+
+    assert [buckets.take('ip:1', 3, 1 / 20)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = buckets.take('ip:1', 3, 1 / 20)
+    assert not allowed
+    assert retry_after == pytest.approx(20)
+    assert buckets.take('ip:2', 3, 1 / 20)[0]
+
+def test_bucket_refills_over_time(app, clock):
+    buckets = app.MemoryBucketStore(100)
+    for _ in range(3):
+        buckets.take('ip:1', 3, 1 / 20)
+
+    clock.now += 10
+    allowed, retry_after = buckets.take('ip:1', 3, 1 / 20)
+    assert not allowed
+    assert retry_after == pytest.approx(10)
+
+    clock.now += 10
+    assert buckets.take('ip:1', 3, 1 / 20)[0]
+    assert not buckets.take('ip:1', 3, 1 / 20)[0]
+
+    clock.now += 3600
+    assert [buckets.take('ip:1', 3, 1 / 20)[0] for _ in range(4)] == [True, True, True, False]
+
+def test_bucket_evicts_least_recently_used_keys(app, clock):
+    buckets = app.MemoryBucketStore(2)
+    buckets.take('ip:1', 1, 1 / 60)
+    buckets.take('ip:2', 1, 1 / 60)
+    buckets.take('ip:3', 1, 1 / 60)
+
+    assert buckets.take('ip:1', 1, 1 / 60)[0]
+    assert not buckets.take('ip:3', 1, 1 / 60)[0]
+
+def test_route_sheds_with_retry_after(app, client, clock, monkeypatch):
+    monkeypatch.setattr(app, 'rate_limiter', app.RateLimiter(app.MemoryBucketStore(100), {'auth_google': '2/60'}))
+
+    statuses = [client.post('/api/auth/google', json={}).status_code for _ in range(3)]
+    assert statuses == [400, 400, 429]
+
+    response = client.post('/api/auth/google', json={})
+    assert response.headers['Retry-After'] == '30'
+    assert app.rate_limiter.stats()['auth_google'] == {'allowed': 2, 'shed': 2, 'errors': 0}
+
+def test_falls_back_to_memory_when_store_fails(app, clock):
+    limiter = app.RateLimiter(FailingStore(), {'auth_google': '2/60'}, fallback=app.MemoryBucketStore(100))
+
+    results = [limiter.check('auth_google', 'ip:1') for _ in range(3)]
+    assert results[:2] == [None, None]
+    assert results[2] == pytest.approx(30)
+    assert limiter.stats()['auth_google'] == {'allowed': 2, 'shed': 1, 'errors': 3}
+
+def test_fails_open_without_a_fallback(app, clock):
+    limiter = app.RateLimiter(FailingStore(), {'auth_google': '2/60'})
+
+    assert [limiter.check('auth_google', 'ip:1') for _ in range(3)] == [None, None, None]
+    assert limiter.stats()['auth_google'] == {'allowed': 0, 'shed': 0, 'errors': 3}
+
+def test_unknown_tokens_are_shed_without_a_session_lookup(app, client, store, clock, monkeypatch):
+    monkeypatch.setattr(app, 'rate_limiter', app.RateLimiter(app.MemoryBucketStore(100), {'feedback': '2/60'}))
+    calls = store.calls
+
+    statuses = [
+        client.post('/api/feedback', json={}, headers={'Authorization': f'Bearer bogus-{i}'}).status_code
+        for i in range(5)
+    ]
+
+    assert statuses == [400, 400, 429, 429, 429]
+    assert store.calls == calls
+
+def test_signed_in_users_get_their_own_bucket(app, client, clock, monkeypatch):
+    monkeypatch.setattr(app, 'rate_limiter', app.RateLimiter(app.MemoryBucketStore(100), {'feedback': '2/60'}))
+    token = app.create_signed_session('user-1', app.datetime.utcnow() + app.timedelta(hours=1))
+    for _ in range(2):
+        client.post('/api/feedback', json={})
+
+    assert client.post('/api/feedback', json={}).status_code == 429
+    assert client.post('/api/feedback', json={}, headers={'Authorization': f'Bearer {token}'}).status_code == 400
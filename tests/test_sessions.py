@@ -0,0 +1,106 @@
+"""Signed session tokens: signing, expiry, key rotation and revocation"""
+import json
+from datetime import datetime, timedelta
+
+def issue(app, user_uuid='user-1', hours=1):
+    return app.create_signed_session(user_uuid, datetime.utcnow() + timedelta(hours=hours))
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+def test_signed_token_round_trip(app):
+    token = issue(app)
+
+    assert token.startswith('v1.k1.')
+    assert app.verify_session(token) == 'user-1'
+
+def test_tampered_claims_are_rejected(app):
+    token = issue(app)
+    prefix, key_id, payload, signature = token.split('.')
+    claims = json.loads(app._b64decode(payload))
+    claims['u'] = 'someone-else'
+    forged = app._b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+
+    assert app.verify_session(f'{prefix}.{key_id}.{forged}.{signature}') is None
+    assert app.verify_session(f'{prefix}.{key_id}.{payload}.{signature[:-2]}AA') is None
+    assert app.verify_session('v1.not-a-token') is None
+
+def test_expired_token_is_rejected(app):
+    assert app.verify_session(issue(app, hours=-1)) is None
+
+def test_rotated_keys_still_verify_until_removed(app, monkeypatch):
+    old_token = issue(app)
+
+    monkeypatch.setattr(app, 'SESSION_SIGNING_KEYS', [('k2', 'second-test-secret'), ('k1', 'first-test-secret')])
+    new_token = issue(app, user_uuid='user-2')
+    assert new_token.startswith('v1.k2.')
+    assert app.verify_session(old_token) == 'user-1'
+    assert app.verify_session(new_token) == 'user-2'
+
+    monkeypatch.setattr(app, 'SESSION_SIGNING_KEYS', [('k2', 'second-test-secret')])
+    assert app.verify_session(old_token) is None
+    assert app.verify_session(new_token) == 'user-2'
+
+def test_logout_revokes_the_token(app, client, store):
+    token = issue(app)
+
+    assert client.post('/api/auth/logout', headers=auth(token)).status_code == 200
+    assert app.verify_session(token) is None
+    assert client.post('/api/auth/logout', headers=auth(token)).status_code == 401
+    assert len(store.rows('revoked_sessions')) == 1
+
+def test_revoking_twice_is_a_no_op(app, store):
+    claims = app.signed_session_claims(issue(app))
+
+    app.revoked_sessions.revoke(claims)
+    app.RevocationList(30, 1000).revoke(claims)
+
+    assert [row['jti'] for row in store.rows('revoked_sessions')] == [claims['jti']]
+
+def test_new_process_sees_tokens_revoked_elsewhere(app):
+    token = issue(app)
+    app.RevocationList(30, 1000).revoke(app.signed_session_claims(token))
+
+    assert app.verify_session(token) is None
+
+def test_unchecked_token_counts_as_revoked(app, monkeypatch):
+    class Unreachable:
+        def table(self, name):
+            raise ConnectionError('backend unreachable')
+
+    token = issue(app)
+    monkeypatch.setattr(app, 'supabase', Unreachable())
+
+    assert app.verify_session(token) is None
+
+def revoke_in_database(store, count, hours=1):
+    expires_at = (datetime.utcnow() + timedelta(hours=hours)).isoformat()
+    jtis = [f'jti-{len(store.rows("revoked_sessions")) + i}' for i in range(count)]
+    store.insert('revoked_sessions', [{'jti': jti, 'user_uuid': 'user-1', 'expires_at': expires_at} for jti in jtis])
+    return jtis
+
+def test_load_pages_through_every_revocation(app, store):
+    jtis = revoke_in_database(store, 25)
+    expired = revoke_in_database(store, 3, hours=-1)
+    revocations = app.RevocationList(30, 10)
+    calls = store.calls
+
+    assert all(revocations.is_revoked(jti) for jti in jtis)
+    assert store.calls - calls == 3
+    assert not any(revocations.is_revoked(jti) for jti in expired)
+
+def test_sync_reads_only_new_revocations(app, store):
+    revoke_in_database(store, 25)
+    revocations = app.RevocationList(30, 10)
+    revocations._load()
+
+    added = revoke_in_database(store, 2)
+    calls = store.calls
+    revocations._sync()
+
+    assert store.calls - calls == 1
+    assert all(revocations.is_revoked(jti) for jti in added)
+
+    later = revoke_in_database(store, 1)
+    revocations._sync()
+    assert revocations.is_revoked(later[0])
@@ -0,0 +1,39 @@
+"""POST /api/subscribe: normalization and repeat signups"""
+import pytest
+
+@pytest.fixture
+def subscribe(app, tmp_path, monkeypatch):
+    """Post to /api/subscribe with synchronous writes and an index that never scans"""
+    monkeypatch.setattr(app, 'write_buffer', app.WriteBuffer(
+        str(tmp_path), 100, 500, 3, conflicts={'universal_subscription': 'email'}, background=False))
+    monkeypatch.setattr(app, 'subscription_index', app.SubscriptionIndex(600, 1000, preload=False))
+    client = app.app.test_client()
+    return lambda email: client.post('/api/subscribe', json={'email': email})
+
+def test_new_email_is_stored_normalized(app, store, subscribe):
+    response = subscribe('  New@Example.com ')
+
+    assert response.status_code == 200
+    assert [row['email'] for row in store.rows('universal_subscription')] == ['new@example.com']
+
+def test_email_stored_elsewhere_is_rejected(app, store, subscribe):
+    store.insert('universal_subscription', [{'email': 'a@example.com'}])
+
+    response = subscribe('A@example.com')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Email already subscribed'}
+    assert len(store.rows('universal_subscription')) == 1
+    assert app.subscription_index.stats()['loads'] == 0
+
+def test_repeat_signup_in_this_process_is_rejected(app, store, subscribe):
+    assert subscribe('b@example.com').status_code == 200
+    assert subscribe('B@example.com').status_code == 400
+    assert app.subscription_index.stats()['rejected'] == 1
+
+@pytest.mark.parametrize('body', [{}, {'email': ''}, {'email': '   '}, {'email': ['a@example.com']}])
+def test_missing_email_is_a_400(app, client, body):
+    response = client.post('/api/subscribe', json=body)
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Email is required'}
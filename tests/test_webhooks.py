@@ -0,0 +1,123 @@
+"""Stripe webhook queue: recording, dedupe, claims, retries and recovery"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+@pytest.fixture
+def user(store):
+    return store.insert('users', [{'email': 'buyer@example.com', 'name': 'Buyer', 'google_id': 'g-1'}])[0]
+
+@pytest.fixture
+def make_queue(app):
+    def make_queue(background=False, workers=1, retry_base_seconds=0.01, recover_seconds=3600):
+        return app.WebhookQueue(workers, 50, 3, retry_base_seconds, 900, recover_seconds, background=background)
+    return make_queue
+
+def checkout(event_id, user, metaphor_id='metaphor-1'):
+    return {
+        'id': event_id,
+        'type': 'checkout.session.completed',
+        'data': {'object': {
+            'client_reference_id': f"{user['uuid']}_{metaphor_id}",
+            'customer_details': {'email': user['email']}
+        }}
+    }
+
+def events(store):
+    return {row['event_id']: row for row in store.rows('stripe_events')}
+
+def purchases(store):
+    return sorted((row['user_uuid'], row['metaphor_id']) for row in store.rows('user_purchases'))
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def test_inline_enqueue_fulfils_the_event(app, store, user, make_queue):
+    webhooks = make_queue()
+
+    assert webhooks.enqueue(checkout('evt_1', user)) is True
+
+    assert purchases(store) == [(user['uuid'], 'metaphor-1')]
+    assert events(store)['evt_1']['status'] == 'processed'
+    assert webhooks.counters['processed'] == 1
+
+def test_redelivery_is_a_duplicate(app, store, user, make_queue):
+    webhooks = make_queue()
+    webhooks.enqueue(checkout('evt_1', user))
+
+    assert webhooks.enqueue(checkout('evt_1', user)) is False
+    assert webhooks.counters['duplicates'] == 1
+    assert webhooks.counters['enqueued'] == 1
+    assert len(store.rows('user_purchases')) == 1
+
+def test_failed_inline_event_is_released_and_fulfilled_on_redelivery(app, store, user, make_queue, monkeypatch):
+    webhooks = make_queue()
+    fulfill = webhooks._fulfill
+    monkeypatch.setattr(webhooks, '_fulfill', lambda batch: (_ for _ in ()).throw(ConnectionError('down')))
+
+    with pytest.raises(ConnectionError):
+        webhooks.enqueue(checkout('evt_1', user))
+    assert events(store)['evt_1']['status'] == 'pending'
+    assert events(store)['evt_1']['attempts'] == 1
+
+    monkeypatch.setattr(webhooks, '_fulfill', fulfill)
+    assert webhooks.enqueue(checkout('evt_1', user)) is True
+    assert events(store)['evt_1']['status'] == 'processed'
+    assert purchases(store) == [(user['uuid'], 'metaphor-1')]
+
+def test_workers_fulfil_each_event_once(app, store, user, make_queue):
+    webhooks = make_queue(background=True, workers=2)
+
+    for i in range(20):
+        assert webhooks.enqueue(checkout(f'evt_{i}', user, f'metaphor-{i % 5}')) is True
+    assert webhooks.enqueue(checkout('evt_0', user)) is False
+    wait_until(lambda: webhooks.stats()['processed'] == 20)
+    time.sleep(0.05)
+
+    stats = webhooks.stats()
+    assert (stats['enqueued'], stats['duplicates'], stats['recovered'], stats['processed']) == (20, 1, 0, 20)
+    assert {row['status'] for row in events(store).values()} == {'processed'}
+    assert purchases(store) == [(user['uuid'], f'metaphor-{i}') for i in range(5)]
+
+def test_failed_batch_is_retried_while_still_claimed(app, store, user, make_queue, monkeypatch):
+    webhooks = make_queue(background=True)
+    fulfill = webhooks._fulfill
+    calls = []
+
+    def flaky(batch):
+        calls.append([row['event_id'] for row in batch])
+        if len(calls) == 1:
+            assert events(store)['evt_1']['status'] == 'processing'
+            raise ConnectionError('down')
+        return fulfill(batch)
+    monkeypatch.setattr(webhooks, '_fulfill', flaky)
+
+    webhooks.enqueue(checkout('evt_1', user))
+    wait_until(lambda: webhooks.stats()['processed'] == 1)
+
+    assert calls == [['evt_1'], ['evt_1']]
+    assert webhooks.stats()['retried'] == 1
+    assert make_queue().drain_pending() == 0
+    assert events(store)['evt_1']['attempts'] == 1
+
+def test_only_unheld_events_are_recovered(app, store, user, make_queue):
+    now = datetime.utcnow()
+    store.insert('stripe_events', [
+        {'event_id': 'evt_pending', 'type': 'checkout.session.completed', 'status': 'pending', 'attempts': 0,
+         'client_reference_id': f"{user['uuid']}_metaphor-1"},
+        {'event_id': 'evt_abandoned', 'type': 'checkout.session.completed', 'status': 'processing', 'attempts': 0,
+         'client_reference_id': f"{user['uuid']}_metaphor-2", 'claimed_at': (now - timedelta(hours=1)).isoformat()},
+        {'event_id': 'evt_held', 'type': 'checkout.session.completed', 'status': 'processing', 'attempts': 0,
+         'client_reference_id': f"{user['uuid']}_metaphor-3", 'claimed_at': now.isoformat()}
+    ])
+
+    assert make_queue().drain_pending() == 2
+    assert make_queue().drain_pending() == 0
+
+    statuses = {event_id: row['status'] for event_id, row in events(store).items()}
+    assert statuses == {'evt_pending': 'processed', 'evt_abandoned': 'processed', 'evt_held': 'processing'}
+    assert purchases(store) == [(user['uuid'], 'metaphor-1'), (user['uuid'], 'metaphor-2')]
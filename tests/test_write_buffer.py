@@ -0,0 +1,131 @@
+"""Write-behind buffer: spill files, retries after a failed flush and crash replay"""
+import json
+import os
+
+import pytest
+
+class Unreachable:
+    def table(self, name):
+        raise ConnectionError('backend unreachable')
+
+@pytest.fixture
+def make_buffer(app, tmp_path, monkeypatch):
+    """Build WriteBuffers spilling to a per-test directory, flushed only when asked"""
+    monkeypatch.setattr(app.atexit, 'register', lambda f: None)
+
+    def make_buffer(background=True, max_attempts=5):
+        return app.WriteBuffer(str(tmp_path), 100, 600000, max_attempts,
+                               conflicts={'universal_subscription': 'email'}, background=background)
+    return make_buffer
+
+def spilled(buffer):
+    """Rows in the spill files of buffer's directory, failed-* files excluded"""
+    rows = []
+    for name in sorted(os.listdir(buffer.spill_dir)):
+        if not name.startswith('failed-'):
+            with open(os.path.join(buffer.spill_dir, name), encoding='utf-8') as f:
+                rows.extend(json.loads(line) for line in f)
+    return rows
+
+def test_flush_writes_buffered_rows_in_one_batch(app, store, make_buffer):
+    buffer = make_buffer()
+
+    assert buffer.append('feedback', {'message': 'one'}) == 'queued'
+    assert buffer.append('feedback', {'message': 'two'}) == 'queued'
+    assert len(spilled(buffer)) == 2
+    buffer.flush()
+
+    assert [row['message'] for row in store.rows('feedback')] == ['one', 'two']
+    assert spilled(buffer) == []
+    assert buffer.stats() == dict(buffer.counters, pending=0)
+    assert buffer.counters['batches'] == 1
+
+def test_failed_flush_keeps_rows_spilled_for_retry(app, store, make_buffer, monkeypatch):
+    buffer = make_buffer()
+    buffer.append('feedback', {'message': 'one'})
+    buffer.append('feedback', {'message': 'two'})
+
+    supabase = app.supabase
+    monkeypatch.setattr(app, 'supabase', Unreachable())
+    buffer.flush()
+
+    assert store.rows('feedback') == []
+    assert buffer.stats()['pending'] == 2
+    assert buffer.counters['retried'] == 2
+    assert [(e['row']['message'], e['attempts']) for e in spilled(buffer)] == [('one', 1), ('two', 1)]
+
+    monkeypatch.setattr(app, 'supabase', supabase)
+    buffer.flush()
+
+    assert [row['message'] for row in store.rows('feedback')] == ['one', 'two']
+    assert spilled(buffer) == []
+
+def test_spill_is_replayed_after_a_crash(app, store, make_buffer, monkeypatch):
+    crashed = make_buffer()
+    crashed.append('feedback', {'message': 'one'})
+    crashed.append('feedback', {'message': 'two'})
+    supabase = app.supabase
+    monkeypatch.setattr(app, 'supabase', Unreachable())
+    crashed.flush()
+
+    # A live process's spill file is locked, so nobody else replays it
+    bystander = make_buffer()
+    bystander.start()
+    assert bystander.counters['recovered'] == 0
+    assert [e['row']['message'] for e in spilled(crashed)] == ['one', 'two']
+
+    # The process dies: its lock goes away but the file stays behind
+    crashed._spill.close()
+    crashed._pending = {}
+    monkeypatch.setattr(app, 'supabase', supabase)
+
+    replay = make_buffer()
+    replay.start()
+    assert replay.counters['recovered'] == 2
+    replay.flush()
+
+    assert [row['message'] for row in store.rows('feedback')] == ['one', 'two']
+    assert spilled(replay) == []
+
+def test_rows_are_set_aside_after_max_attempts(app, store, make_buffer, monkeypatch):
+    buffer = make_buffer(max_attempts=2)
+    buffer.append('feedback', {'message': 'one'})
+    monkeypatch.setattr(app, 'supabase', Unreachable())
+
+    buffer.flush()
+    buffer.flush()
+
+    assert buffer.stats()['pending'] == 0
+    assert buffer.counters['failed'] == 1
+    assert spilled(buffer) == []
+    with open(os.path.join(buffer.spill_dir, f'failed-{os.getpid()}.jsonl'), encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == [{'table': 'feedback', 'row': {'message': 'one'}, 'attempts': 2}]
+
+def test_duplicate_subscription_does_not_fail_the_batch(app, store, make_buffer):
+    buffer = make_buffer()
+    for email in ['a@example.com', 'b@example.com', 'a@example.com']:
+        buffer.append('universal_subscription', {'email': email})
+    buffer.flush()
+
+    assert sorted(row['email'] for row in store.rows('universal_subscription')) == ['a@example.com', 'b@example.com']
+    assert buffer.counters['batches'] == 1
+    assert buffer.counters['retried'] == 0
+
+def test_without_background_rows_are_written_before_returning(app, store, make_buffer, monkeypatch):
+    buffer = make_buffer(background=False)
+
+    assert buffer.append('feedback', {'message': 'one'}) == 'written'
+    assert [row['message'] for row in store.rows('feedback')] == ['one']
+    assert os.listdir(buffer.spill_dir) == []
+
+    monkeypatch.setattr(app, 'supabase', Unreachable())
+    with pytest.raises(ConnectionError):
+        buffer.append('feedback', {'message': 'two'})
+
+def test_without_background_duplicates_are_reported(app, store, make_buffer):
+    buffer = make_buffer(background=False)
+
+    assert buffer.append('universal_subscription', {'email': 'a@example.com'}) == 'written'
+    assert buffer.append('universal_subscription', {'email': 'a@example.com'}) == 'duplicate'
+    assert buffer.counters['duplicates'] == 1
+    assert len(store.rows('universal_subscription')) == 1
@@ -2,6 +2,7 @@
 
 let metaphors = METAPHOR_CATALOG.slice();
 let userPurchases = [];
+let metaphorContent = {};
 const STRIPE_LINK_BASE = "https://buy.stripe.com/5kQdR125Y1uJfRk30e5gc00";
 
 function getStripeLink(metaphorId) {
@@ -17,41 +18,46 @@ function getStripeLink(metaphorId) {
 
 async function loadMetaphors() {
   try {
-    // Load metaphors from database instead of static catalog
-    const metaphorsResponse = await fetch('/api/metaphors');
-    if (metaphorsResponse.ok) {
-      const data = await metaphorsResponse.json();
-      // Handle case where API returns empty array or error object
-      if (Array.isArray(data) && data.length > 0) {
-        metaphors = data;
+    // Catalog, bundles, purchases and preview/full content come back in one request
+    const headers = (typeof AuthManager !== 'undefined' && AuthManager.isLoggedIn())
+      ? AuthManager.getAuthHeaders()
+      : {};
+    const libraryResponse = await fetch('/api/library', { headers });
+    let bundles = [];
+    metaphorContent = {};
+
+    if (libraryResponse.ok) {
+      const library = await libraryResponse.json();
+      // Handle case where API returns an empty catalog
+      if (Array.isArray(library.metaphors) && library.metaphors.length > 0) {
+        metaphors = library.metaphors;
+        library.metaphors.forEach(m => {
+          metaphorContent[m.id] = {
+            id: m.id,
+            title: m.title,
+            content: m.content,
+            has_access: m.has_access,
+            is_preview: m.is_preview
+          };
+        });
         console.log('Loaded', metaphors.length, 'metaphors from API');
       } else {
         console.warn('API returned empty data, using static catalog');
         metaphors = METAPHOR_CATALOG.slice();
       }
+      userPurchases = library.purchases || [];
+      bundles = library.bundles || [];
     } else {
-      console.warn('API error, using static catalog:', metaphorsResponse.status);
+      console.warn('API error, using static catalog:', libraryResponse.status);
       // Fallback to static catalog
       metaphors = METAPHOR_CATALOG.slice();
-    }
-    
-    metaphors.sort((a, b) => (a.order_index ?? 9999) - (b.order_index ?? 9999));
-
-    if (typeof AuthManager !== 'undefined' && AuthManager.isLoggedIn()) {
-      const purchasesResponse = await fetch('/api/user/purchases', {
-        headers: AuthManager.getAuthHeaders()
-      });
-      if (purchasesResponse.ok) {
-        userPurchases = await purchasesResponse.json();
-      } else {
-        userPurchases = [];
-      }
-    } else {
       userPurchases = [];
     }
 
+    metaphors.sort((a, b) => (a.order_index ?? 9999) - (b.order_index ?? 9999));
+
     renderMetaphors();
-    await loadBundles();
+    renderBundles(bundles);
   } catch (error) {
     console.error('Error loading metaphors:', error);
     // Fallback to static catalog
@@ -59,6 +65,7 @@ async function loadMetaphors() {
       .slice()
       .sort((a, b) => (a.order_index ?? 9999) - (b.order_index ?? 9999));
     userPurchases = [];
+    metaphorContent = {};
     renderMetaphors();
   }
 }
@@ -136,14 +143,20 @@ function toggleMoreLenses() {
 }
 
 function showPreview(metaphorId) {
-  fetchMetaphorContent(metaphorId, false);
+  fetchMetaphorContent(metaphorId);
 }
 
 function readFull(metaphorId) {
   window.location.href = `/metaphors/${metaphorId}`;
 }
 
-async function fetchMetaphorContent(metaphorId, isFullAccess) {
+async function fetchMetaphorContent(metaphorId) {
+  // Content already delivered by /api/library
+  if (metaphorContent[metaphorId]) {
+    displayMetaphorContent(metaphorContent[metaphorId]);
+    return;
+  }
+
   try {
     const response = await fetch(`/api/metaphors/${metaphorId}/content`, {
       headers: AuthManager.getAuthHeaders()
@@ -157,18 +170,7 @@ async function fetchMetaphorContent(metaphorId, isFullAccess) {
     displayMetaphorContent(data);
   } catch (error) {
     console.error('Error fetching metaphor content:', error);
-    // Fallback to static content
-    const metaphor = metaphors.find(m => m.id === metaphorId);
-    if (metaphor) {
-      const fallbackData = {
-        id: metaphor.id,
-        title: metaphor.title,
-        content: isFullAccess ? metaphor.full_content : metaphor.preview_content,
-        has_access: isFullAccess,
-        is_preview: !isFullAccess
-      };
-      displayMetaphorContent(fallbackData);
-    }
+    alert('Could not load this metaphor. Please try again later.');
   }
 }
 
@@ -230,19 +232,6 @@ async function unlockMetaphor(metaphorId) {
   }
 }
 
-
-async function loadBundles() {
-  try {
-    const response = await fetch('/api/bundles');
-    if (response.ok) {
-      const bundles = await response.json();
-      renderBundles(bundles);
-    }
-  } catch (error) {
-    console.error('Error loading bundles:', error);
-  }
-}
-
 function renderBundles(bundles) {
   const bundlesGrid = document.getElementById('bundlesGrid');
   if (!bundles || bundles.length === 0) {